@@ -0,0 +1,34 @@
+"""
+Micro-benchmarks for rest-cli's parsing, filtering and rendering code.
+
+Benchmarks register themselves with the 'benchmark' decorator and are run by 'benchmarks.run', which writes JSON results that can be compared between commits.
+"""
+
+from collections import namedtuple
+
+
+Benchmark = namedtuple('Benchmark', ['group', 'name', 'setup', 'sizes'])
+
+# number of records/keys used to build the synthetic documents for each size
+SIZES = {
+    'small': 100,
+    'medium': 10000,
+    'large': 100000
+}
+
+BENCHMARKS = []
+
+
+def benchmark(group, sizes=None):
+    '''
+    Register a benchmark. The decorated function is given a size (e.g. 100 records) and returns either a callable to time, or a (prepare, func) tuple where prepare() runs untimed before each call and returns the arguments for func.
+    '''
+    def register(setup):
+        BENCHMARKS.append(Benchmark(
+            group=group,
+            name=setup.__name__,
+            setup=setup,
+            sizes=sizes or sorted(SIZES, key=SIZES.get)
+        ))
+        return setup
+    return register
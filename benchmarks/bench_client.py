@@ -0,0 +1,35 @@
+"""Benchmarks for request URL and query string building."""
+
+from benchmarks import benchmark, documents
+from rest_cli.client import RESTClient
+
+
+@benchmark('client')
+def build_query(size):
+    params = documents.params(size)
+    return lambda: RESTClient.build_query(params)
+
+
+@benchmark('client', sizes=['small'])
+def build_url(size):
+    client = RESTClient('https://api.example.com:8443/v1/?key=abc')
+    paths = ['customers/%d/orders/' % i for i in range(size)]
+
+    def run():
+        for path in paths:
+            client._build_url(path, 'page=2&per_page=50')
+    return run
+
+
+@benchmark('client', sizes=['small'])
+def parse_url(size):
+    client = RESTClient()
+    urls = [
+        'https://user@api%d.example.com:8443/v1/items;p=1?q=%d#frag' % (i, i)
+        for i in range(size)
+    ]
+
+    def run():
+        for url in urls:
+            client.parse_url(url)
+    return run
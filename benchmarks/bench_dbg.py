@@ -0,0 +1,32 @@
+"""Benchmarks for rendering decoded responses."""
+
+import os
+
+from benchmarks import benchmark, documents, legacy_dbg
+from rest_cli import dbg
+
+
+@benchmark('dbg', sizes=['small', 'medium'])
+def obj2str_records(size):
+    doc = documents.records(size)
+    return lambda: dbg.obj2str(doc)
+
+
+@benchmark('dbg', sizes=['small', 'medium'])
+def obj2str_nested(size):
+    doc = documents.nested(size)
+    return lambda: dbg.obj2str(doc, color=False)
+
+
+# the original renderer is quadratic in nesting; medium documents take close to a minute
+@benchmark('dbg', sizes=['small'])
+def obj2str_records_legacy(size):
+    doc = documents.records(size)
+    return lambda: legacy_dbg.obj2str(doc)
+
+
+@benchmark('dbg', sizes=['small', 'medium'])
+def pretty_print_records(size):
+    doc = documents.records(size)
+    devnull = open(os.devnull, 'w')
+    return lambda: dbg.pretty_print(doc, stream=devnull)
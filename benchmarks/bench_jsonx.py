@@ -0,0 +1,58 @@
+"""Benchmarks for JSON path extraction, exclusion and key parsing."""
+
+import copy
+
+from benchmarks import benchmark, documents
+from rest_cli import jsonx
+
+
+@benchmark('jsonx')
+def extract_records(size):
+    doc = documents.records(size)
+    return lambda: jsonx.extract_path(doc, 'items/*/owner/email')
+
+
+@benchmark('jsonx')
+def extract_regex(size):
+    doc = documents.records(size)
+    return lambda: jsonx.extract_path(doc, 'items/:-2/.*[pP]assw(or)?d', quiet=True)
+
+
+@benchmark('jsonx')
+def extract_nested(size):
+    doc = documents.nested(size)
+    return lambda: jsonx.extract_path(doc, 'root/node.*/list/*/node0', quiet=True)
+
+
+@benchmark('jsonx')
+def exclude_in_place(size):
+    doc = documents.records(size)
+    return (
+        lambda: (copy.deepcopy(doc),),
+        lambda obj: jsonx.exclude_path(obj, 'items/1:-1/owner')
+    )
+
+
+@benchmark('jsonx')
+def exclude_copy(size):
+    doc = documents.records(size)
+    paths = ['items/*/owner/password', 'items/0:10', 'meta/next']
+    return lambda: jsonx.exclude_paths(doc, paths)
+
+
+@benchmark('jsonx')
+def parse_keys_range(size):
+    items = documents.records(size)['items']
+    return lambda: jsonx.parse_keys(items, '2:-2')
+
+
+@benchmark('jsonx')
+def parse_keys_regex(size):
+    doc = documents.wide(size)
+    return lambda: jsonx.parse_keys(doc, 'key_0+[1-5].*')
+
+
+@benchmark('jsonx')
+def jsonx_extract_encoded(size):
+    doc = documents.records(size)
+    return lambda: jsonx.jsonx(doc, extract=['items/*/name'], exclude=['meta'])
@@ -0,0 +1,50 @@
+"""Benchmarks for shell command and parameter parsing."""
+
+import os
+import sys
+
+from benchmarks import benchmark
+
+
+def quiet_shell():
+    '''Returns a shell that has done nothing but print help, with the help text discarded.'''
+    from rest_cli.shell import Shell
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, 'w')
+    try:
+        return Shell(['--help'])
+    finally:
+        sys.stderr.close()
+        sys.stderr = stderr
+
+
+@benchmark('shell', sizes=['small'])
+def parse_args(size):
+    shell = quiet_shell()
+    cmds = [
+        'post customers/%d/orders -H "X-Trace: %d" -Q page=2 -x items/*/id -X items/0 '
+        '-d ids=items/*/id foo.bar=3 foo.baz:=[1,2,3] !deleted > /tmp/out.json' % (i, i)
+        for i in range(size)
+    ]
+
+    def run():
+        for cmd in cmds:
+            shell.parse_args(cmd)
+    return run
+
+
+@benchmark('shell')
+def parse_param(size):
+    shell = quiet_shell()
+    shell.data_store['ids'] = list(range(100))
+    params = [
+        ('a%d.b%d.c=%d' % (i % 10, i, i), 'n%d:=[%d, {"x": true}]' % (i, i), 'ids+=', '!flag%d' % i)
+        for i in range(size)
+    ]
+
+    def run():
+        merged = {}
+        for group in params:
+            for param in group:
+                shell.parse_param(param, merged)
+    return run
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""Synthetic documents of various sizes and shapes for benchmarking."""
+
+import random
+
+
+def records(count, seed=42):
+    '''An API-style listing: a long array of small, similar records plus some metadata.'''
+    rand = random.Random(seed)
+    return {
+        'items': [
+            {
+                'id': i,
+                'name': 'item-%d' % i,
+                'size': rand.randint(0, 100000),
+                'active': bool(i % 3),
+                'score': rand.random() * 100,
+                'tags': ['tag-%d' % (i % 7), 'tag-%d' % (i % 11)],
+                'owner': {
+                    'id': i % 97,
+                    'email': 'user%d@example.com' % (i % 97),
+                    'password': 'hunter%d' % i
+                },
+                'description': u'Item number %d ✓' % i
+            }
+            for i in range(count)
+        ],
+        'meta': {
+            'count': count,
+            'next': '/items?page=2',
+            'prev': None
+        }
+    }
+
+
+def nested(count, breadth=4):
+    '''A deep tree of dicts and lists with roughly count leaves.'''
+    def build(remaining, depth):
+        if remaining <= breadth or depth > 12:
+            return dict(('leaf%d' % i, i * depth) for i in range(max(remaining, 1)))
+        per_child = remaining // breadth
+        node = dict(
+            ('node%d' % i, build(per_child, depth + 1))
+            for i in range(breadth - 1)
+        )
+        node['list'] = [build(per_child // 2, depth + 1), build(per_child // 2, depth + 1)]
+        return node
+    return {'root': build(count, 0)}
+
+
+def wide(count):
+    '''A single flat dict with many keys.'''
+    return dict(('key_%06d' % i, 'value %d' % i) for i in range(count))
+
+
+def params(count):
+    '''API parameters as built by the shell from dotted/JSON arguments.'''
+    return dict(
+        ('group%d' % i, {
+            'name': 'group %d' % i,
+            'enabled': bool(i % 2),
+            'ids': list(range(i % 5)),
+            'options': {'limit': i, 'sort': 'name asc'}
+        })
+        for i in range(count)
+    )
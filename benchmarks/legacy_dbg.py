@@ -0,0 +1,115 @@
+"""The original recursive string-building renderer from rest_cli.dbg, kept as a baseline for the streaming renderer."""
+
+from rest_cli.dbg import dark_colors, light_colors, get_obj_info
+
+
+def obj2str(obj, depth=0, color=True, indent_char=' ', indent_size=4, inline=True, short_form=False, invert_color=False):
+    """Returns a formatted string, optionally with color coding"""
+
+    palette = light_colors if invert_color else dark_colors
+
+    def shell_color(obj, obj_color):
+        if color:
+            return '\033[%sm%s\033[0;0m' % (obj_color, unicode(obj))
+        else:
+            return unicode(obj)
+
+    def rdump(obj, depth=0, indent_size=4, inline=False, short_form=False):
+        if short_form:
+            return unicode(obj)[0:80 - (depth * indent_size)]
+        obj_info = get_obj_info(obj)
+        # indent ourselves
+        dump = depth * (indent_size * indent_char)
+        # see what we've got and recurse as needed
+        if obj_info['type'] == 'list':
+            if not len(obj):
+                dump += shell_color(' []', palette['object']) + '\n'
+            else:
+                skip_next_indent = True
+                for i in range(0, len(obj)):
+                    item = obj[i]
+                    item_info = get_obj_info(item)
+                    # handy any indentation we may need to do
+                    if skip_next_indent:
+                        skip_next_indent = False
+                    else:
+                        dump += depth * (indent_size * indent_char)
+                    # add in the key, cycling through the available colors based on depth
+                    dump += shell_color(i, palette[obj_info['type']][(depth) % (len(palette[obj_info['type']]))])
+                    # format it depending on whether we've nested list with any empty items
+                    if item_info['type'] in ('dict', 'tuple', 'list'):
+                        if not len(item):
+                            dump += rdump(item, 0, indent_size, True)
+                        else:
+                            dump += '\n' + rdump(item, depth + 1, indent_size, True)
+                    else:
+                        dump += rdump(item, 1, 1)
+        elif obj_info['type'] == 'dict':
+            if not len(obj):
+                dump += shell_color(' {}', palette['object']) + '\n'
+            else:
+                skip_next_indent = True
+                for key in obj:
+                    item = obj[key]
+                    item_info = get_obj_info(item)
+                    # handy any indentation we may need to do
+                    if skip_next_indent:
+                        skip_next_indent = False
+                    else:
+                        dump += depth * (indent_size * indent_char)
+                    # add in the key, cycling through the available colors based on depth
+                    dump += shell_color(key, palette[obj_info['type']][(depth) % (len(palette[obj_info['type']]))])
+                    # add in a bullet
+                    dump += shell_color(':', palette['bullet'])
+                    # format it depending on whether we've nested list with any empty items
+                    if item_info['type'] in ('dict', 'tuple', 'list'):
+                        if not len(item):
+                            dump += rdump(item, 0, indent_size, True)
+                        else:
+                            dump += '\n' + rdump(item, depth + 1, indent_size, True)
+                            if item_info['type'] == 'tuple':
+                                dump += '\n'
+                    else:
+                        dump += rdump(item, 1, 1)
+        elif obj_info['type'] == 'tuple':
+            if not len(obj):
+                dump += shell_color(' ()', palette['object'])
+            else:
+                dump += shell_color('(', palette['bullet'])
+                dump += ', '.join([unicode(item)[0:32] for item in obj if item != ()])
+                dump += shell_color(')', palette['bullet'])
+        elif obj_info['type'] == 'str' or obj_info['type'] == 'unicode':
+            dump += shell_color(obj, palette[obj_info['type']])
+        elif obj_info['type'] == 'bool':
+            dump += shell_color(obj, palette[obj_info['type']])
+        elif obj_info['type'] == 'NoneType':
+            dump += shell_color('(none/null)', palette[obj_info['type']])
+        elif obj_info['type'] == 'int':
+            dump += shell_color(obj, palette[obj_info['type']])
+        elif obj_info['type'] == 'float':
+            dump += shell_color(obj, palette[obj_info['type']])
+        elif obj_info['type'] == 'object':
+            dump += shell_color('(object)', palette[obj_info['type']])
+        elif obj_info['type'] == 'instance':
+            dump += rdump(obj_info, depth)
+        elif obj_info['type'] == 'module':
+            dump += rdump(obj_info, depth)
+        elif obj_info['type'] == 'function':
+            dump += rdump(obj_info, depth)
+        elif obj_info['type'] == 'classobj':
+            dump += rdump(obj_info, depth)
+        elif obj_info['type'] == 'builtin_function_or_method':
+            dump += rdump(obj_info, depth)
+        elif obj_info['type'] == 'ArgSpec':
+            dump += '\n' + rdump({
+                'args': obj.args,
+                'varargs': obj.varargs,
+                'keywords': obj.keywords,
+                'defaults': obj.defaults,
+            }, depth + 1, inline=True)
+        else:
+            dump += rdump(obj_info, depth)
+        if not inline:
+            dump += '\n'
+        return dump  # hack hack hack!
+    return rdump(obj, depth, indent_size, inline, short_form)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+
+"""
+Runs the benchmark suite and writes the results as JSON.
+
+usage: python -m benchmarks.run [-o RESULTS.json] [-c BASELINE.json] [-s small,medium] [-f REGEX]
+"""
+
+import gc
+import json
+import math
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+
+# make sure we benchmark the code in this tree
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks import BENCHMARKS, SIZES
+# importing the modules registers their benchmarks
+from benchmarks import bench_client, bench_dbg, bench_jsonx, bench_shell
+
+
+def usage():
+    sys.stdout.write('''usage: python -m benchmarks.run [ARGS]
+
+ARGUMENTS:
+   -h|--help               This information.
+   -o|--output FILE        Write JSON results to FILE.
+   -c|--compare FILE       Compare against previous JSON results and report changes in median time.
+   -m|--max-regression PCT Exit with a non-zero status if any benchmark is PCT percent slower than
+                           the comparison results (default: no limit).
+   -f|--filter REGEX       Only run benchmarks whose full name matches REGEX.
+   -s|--sizes SIZES        Comma-separated sizes to run (default: small,medium; available: %s).
+   -r|--rounds N           Number of timed rounds per benchmark (default: 5).
+   -t|--min-time SECS      Minimum time per round; loops are added until it is reached (default: 0.05).
+''' % ', '.join(sorted(SIZES, key=SIZES.get)))
+
+
+def get_opts(defaults, argv):
+    i = 1
+    opts = defaults
+    while i < len(argv):
+        arg = argv[i]
+        if arg == '-h' or arg == '--help':
+            usage()
+            exit()
+        elif arg in ('-o', '--output', '-c', '--compare', '-f', '--filter',
+                     '-s', '--sizes', '-r', '--rounds', '-t', '--min-time',
+                     '-m', '--max-regression'):
+            i += 1
+            if i == len(argv):
+                raise Exception("Missing value for %s." % arg)
+            value = argv[i]
+            if arg in ('-o', '--output'):
+                opts['output'] = value
+            elif arg in ('-c', '--compare'):
+                opts['compare'] = value
+            elif arg in ('-f', '--filter'):
+                opts['filter'] = re.compile(value)
+            elif arg in ('-s', '--sizes'):
+                opts['sizes'] = value.split(',')
+                for size in opts['sizes']:
+                    if size not in SIZES:
+                        raise Exception("Unknown size '%s'." % size)
+            elif arg in ('-r', '--rounds'):
+                opts['rounds'] = int(value)
+            elif arg in ('-t', '--min-time'):
+                opts['min_time'] = float(value)
+            else:
+                opts['max_regression'] = float(value)
+        else:
+            raise Exception("Unrecognized argument: %s" % arg)
+        i += 1
+    return opts
+
+
+def time_call(prepare, func, loops):
+    '''Returns the total time spent running func the given number of times; prepare() is not timed.'''
+    total = 0.0
+    for i in range(loops):
+        args = prepare() if prepare else ()
+        start = time.time()
+        func(*args)
+        total += time.time() - start
+    return total
+
+
+def run_benchmark(setup, size, rounds=5, min_time=0.05):
+    '''Time a single benchmark at the given size, returning per-call statistics in seconds.'''
+    prepared = setup(SIZES[size])
+    if isinstance(prepared, tuple):
+        (prepare, func) = prepared
+    else:
+        (prepare, func) = (None, prepared)
+    # figure out how many calls we need for each round to be measurable
+    loops = 1
+    while True:
+        elapsed = time_call(prepare, func, loops)
+        if elapsed >= min_time or loops >= 1000000:
+            break
+        loops *= 10 if elapsed < min_time / 10 else 2
+    timings = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for i in range(rounds):
+            timings.append(time_call(prepare, func, loops) / loops)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    timings.sort()
+    mean = sum(timings) / len(timings)
+    return {
+        'min': timings[0],
+        'max': timings[-1],
+        'median': timings[len(timings) // 2],
+        'mean': mean,
+        'stddev': math.sqrt(sum((t - mean) ** 2 for t in timings) / len(timings)),
+        'rounds': rounds,
+        'loops': loops
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=open(os.devnull, 'w')
+        ).strip()
+    except:
+        return None
+
+
+def compare(results, baseline, max_regression=None):
+    '''Print how each benchmark's median changed versus the baseline results. Returns the names of benchmarks that regressed beyond max_regression percent.'''
+    previous = dict((bench['name'], bench) for bench in baseline['benchmarks'])
+    regressed = []
+    sys.stdout.write('\n%-48s %12s %12s %8s\n' % ('benchmark', 'baseline', 'current', 'change'))
+    for bench in results['benchmarks']:
+        if bench['name'] not in previous:
+            continue
+        old = previous[bench['name']]['median']
+        new = bench['median']
+        change = (new - old) / old * 100 if old else 0.0
+        flag = ''
+        if max_regression is not None and change > max_regression:
+            regressed.append(bench['name'])
+            flag = ' !'
+        sys.stdout.write('%-48s %10.3fms %10.3fms %+7.1f%%%s\n' % (
+            bench['name'], old * 1000, new * 1000, change, flag
+        ))
+    return regressed
+
+
+def main(argv):
+    opts = get_opts({
+        'output': None,
+        'compare': None,
+        'filter': None,
+        'sizes': ['small', 'medium'],
+        'rounds': 5,
+        'min_time': 0.05,
+        'max_regression': None
+    }, argv)
+    results = {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'benchmarks': []
+    }
+    for bench in BENCHMARKS:
+        for size in bench.sizes:
+            if size not in opts['sizes']:
+                continue
+            name = '%s.%s[%s]' % (bench.group, bench.name, size)
+            if opts['filter'] and not opts['filter'].search(name):
+                continue
+            stats = run_benchmark(bench.setup, size, opts['rounds'], opts['min_time'])
+            stats.update({
+                'name': name,
+                'group': bench.group,
+                'size': size,
+                'count': SIZES[size]
+            })
+            results['benchmarks'].append(stats)
+            sys.stdout.write('%-48s %10.3fms (+/- %.3fms, %d loops)\n' % (
+                name, stats['median'] * 1000, stats['stddev'] * 1000, stats['loops']
+            ))
+            sys.stdout.flush()
+    if opts['output']:
+        with open(opts['output'], 'w') as output:
+            json.dump(results, output, indent=4, sort_keys=True)
+    regressed = []
+    if opts['compare']:
+        with open(opts['compare']) as baseline:
+            regressed = compare(results, json.load(baseline), opts['max_regression'])
+    if regressed:
+        sys.stderr.write('%d benchmark(s) regressed by more than %s%%\n' % (
+            len(regressed), opts['max_regression']
+        ))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main(sys.argv))
+    except Exception as e:
+        sys.stderr.write(str(e) + '\n')
+        sys.exit(1)
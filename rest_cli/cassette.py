@@ -0,0 +1,103 @@
+"""Record responses to a directory and play them back later without touching the network, for fast, repeatable runs."""
+
+from StringIO import StringIO
+import hashlib
+import os
+import os.path
+import re
+import tempfile
+import urllib
+import urlparse
+try:
+    import json
+except:
+    import simplejson
+    json = simplejson
+
+import client
+
+
+def normalize_body(body):
+    '''Returns a request body in a canonical form, so equivalent JSON bodies (e.g. with keys in another order) match.'''
+    if not body:
+        return ''
+    try:
+        return json.dumps(json.loads(body), sort_keys=True, separators=(',', ':'))
+    except (ValueError, TypeError):
+        return body
+
+
+def normalize_path(path):
+    '''Returns a request path (e.g. "/users?b=2&a=1") with its query sorted.'''
+    parsed = urlparse.urlparse(path)
+    query = urllib.urlencode(sorted(urlparse.parse_qsl(parsed.query, True)))
+    return parsed.path + ('?' + query if query else '')
+
+
+class Cassette(object):
+    """
+    A directory of recorded responses, keyed by method, path and query (see normalize_path) and normalized request body.
+
+    Paths are relative to the client's base URL, so a cassette recorded against one server can be played back with any other as the base URL.
+
+    Each response is kept as NAME.json (the request and response status/headers) and NAME.body (the raw response body). Recording the same request again replaces it.
+    """
+
+    def __init__(self, directory, playback=False):
+        self.directory = directory
+        self.playback = playback
+        if not playback and not os.path.isdir(directory):
+            os.makedirs(directory)
+        elif playback and not os.path.isdir(directory):
+            raise Exception('No cassette to play back at "%s".' % directory)
+
+    def name(self, method, path, body):
+        '''Returns the file name (without extension) a request's response is kept under, readable enough to find by eye.'''
+        path = normalize_path(path)
+        digest = hashlib.sha1('\n'.join([method.upper(), path, normalize_body(body)])).hexdigest()
+        readable = re.sub(r'[^\w.-]+', '_', path.split('?', 1)[0]).strip('_')[:60]
+        return '%s-%s-%s' % (method.upper(), readable, digest[:16])
+
+    def play(self, method, path, body, stream=False):
+        '''Returns the recorded (meta, body) for a request, as a response's metadata and body would be; the body is file-like if streaming.'''
+        name = os.path.join(self.directory, self.name(method, path, body))
+        try:
+            with open(name + '.json') as meta_file:
+                meta = json.load(meta_file)
+            with open(name + '.body', 'rb') as body_file:
+                data = body_file.read()
+        except IOError:
+            raise Exception('No recorded response for "%s %s" in "%s".' % (
+                method.upper(), normalize_path(path), self.directory
+            ))
+        meta = client.StoredMeta(
+            meta['status'],
+            [(header.encode('utf-8'), value.encode('utf-8')) for (header, value) in meta['headers']]
+        )
+        return (meta, StringIO(data) if stream else data)
+
+    def record(self, method, path, body, response, data, stream=False):
+        '''Save a response, returning (response, body) for the caller to carry on with; a streamed body is read in full first, and handed back file-like.'''
+        if hasattr(data, 'read'):
+            source = data
+            try:
+                data = source.read()
+            finally:
+                source.close()
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        name = os.path.join(self.directory, self.name(method, path, body))
+        meta = {
+            'method': method.upper(),
+            'path': normalize_path(path),
+            'body': body or '',
+            'status': response.status,
+            'headers': list(response.headerslist)
+        }
+        # write then rename, so an interrupted run never leaves half a response behind
+        for (extension, content) in (('.body', data), ('.json', json.dumps(meta, indent=1))):
+            (fd, tmp_path) = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, 'wb') as out:
+                out.write(content)
+            os.rename(tmp_path, name + extension)
+        return (response, StringIO(data) if stream else data)
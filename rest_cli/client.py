@@ -9,12 +9,14 @@
 from collections import namedtuple
 import Cookie
 import base64
+import copy
 import dbg
 import hashlib
 import os
 import re
 import socket
 import sys
+import threading
 import time
 import urllib
 import urlparse
@@ -34,10 +36,39 @@ from restkit.errors import (
 import restkit.oauth2 as oauth
 from restkit import BasicAuth
 
+import profiling
+import stats
 import util
 
 
-Response = namedtuple('Response', ['meta', 'decoded', 'raw'])
+# what was sent for a response: the URL without its query, the final query (any typed in the path, -Q and the base URL's merged), headers and encoded body
+Request = namedtuple('Request', ['method', 'url', 'query', 'headers', 'payload'])
+Response = namedtuple('Response', ['meta', 'decoded', 'raw', 'request'])
+
+
+class _Headers(dict):
+    def __init__(self, headerslist):
+        dict.__init__(self, ((name.lower(), value) for (name, value) in headerslist))
+
+    def get(self, name, default=None):
+        return dict.get(self, name.lower(), default)
+
+    def __getitem__(self, name):
+        return dict.__getitem__(self, name.lower())
+
+    def __contains__(self, name):
+        return dict.__contains__(self, name.lower())
+
+
+class StoredMeta(object):
+    """Stands in for a restkit response's metadata (status, headers) when replaying a stored response."""
+
+    def __init__(self, status, headerslist):
+        self.status = status
+        self.status_int = int(status.split(' ', 1)[0])
+        self.headerslist = list(headerslist)
+        # header names are case-insensitive
+        self.headers = _Headers(self.headerslist)
 
 
 class APIException(Exception):
@@ -47,6 +78,15 @@ class APIException(Exception):
         super(APIException, self).__init__(error)
 
 
+class _Flight(object):
+    """A GET in progress; identical requests made meanwhile wait for its outcome instead of sending their own."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
 class RESTClient:
 
     """Client for talking to a RESTful server."""
@@ -55,9 +95,20 @@ class RESTClient:
         # the base URL information for construction API requests
         self.url = None
         self.cookies = {}  # session cookie cache
+        # requests may be made from several threads at once (e.g. background jobs, fan-outs), each updating the cookies
+        self.cookies_lock = threading.Lock()
         # if set, an oauth/basic authentication header will be included in each request
         self.oauth = None
         self.basic_auth = None
+        # totals for each endpoint requested, by method and path template
+        self.stats = stats.Stats()
+        # if set, each request and response is also recorded to a HAR file (see har.Recorder)
+        self.har = None
+        # if set, responses are recorded to or played back from a directory (see cassette.Cassette)
+        self.cassette = None
+        # identical GETs in progress (see _coalesce), by what makes them identical
+        self.inflight = {}
+        self.inflight_lock = threading.Lock()
         self.set_url(url)
         # if true we'll use the OS environ variables 'http(s)_proxy' for requests
         self.use_proxy = use_proxy
@@ -169,6 +220,16 @@ class RESTClient:
             else:
                 self.set_port(80)
 
+    def untracked(self):
+        '''Returns a copy of the client sharing its session (base URL, auth and cookies) whose requests aren't counted in its stats or recorded to HAR files or cassettes, e.g. for lookups the user didn't ask for.'''
+        other = copy.copy(self)
+        other.stats = stats.Stats()
+        other.har = None
+        other.cassette = None
+        other.inflight = {}
+        other.inflight_lock = threading.Lock()
+        return other
+
     def load_oauth(self, creds):
         '''Sets OAuth keys to be used for each request. Can be set to None to stop using OAuth.'''
         keys = [
@@ -222,9 +283,65 @@ class RESTClient:
         '''Perform a DELETE request with the supplied parameters as the payload. Defaults to JSON encoding.'''
         return self.request('DELETE', path, params, **opts)
 
+    def session_cookies(self):
+        '''Returns a copy of the session cookies, safe to use while other requests update them.'''
+        with self.cookies_lock:
+            return dict(self.cookies)
+
     def request(self, method, path, params=None, query=None, headers=None,
-                verbose=False, full=False, basic_auth=None, pre_formatted=None):
+                verbose=False, full=False, basic_auth=None, pre_formatted=None,
+                decode=True, stream=False):
+        '''
+        Make a request, returning the decoded response (or the full Response if asked) and raising an APIException for error statuses.
+
+        A GET made while an identical one (same URL, query, headers, cookies and auth) is already in progress, e.g. from a background job or a fan-out over a list with duplicates, waits for that one's Response instead of sending its own. Streamed and verbose requests are always sent.
+        '''
+        if (method or 'get').lower() != 'get' or stream or verbose:
+            return self._request(
+                method, path, params, query, headers, verbose, full, basic_auth, pre_formatted, decode, stream
+            )
+        key = json.dumps(
+            [self.url, path, params, query, headers, basic_auth, self.basic_auth, self.oauth, self.session_cookies(), decode],
+            sort_keys=True,
+            default=repr
+        )
+        response = self._coalesce(key, lambda: self._request(
+            method, path, params, query, dict(headers or {}), verbose, True, basic_auth, pre_formatted, decode, stream
+        ))
+        if full:
+            return response
+        return response.decoded
+
+    def _coalesce(self, key, send):
+        '''Returns the full Response from send(), or that of the identical request already in flight (raising its exception, if it failed).'''
+        with self.inflight_lock:
+            flight = self.inflight.get(key)
+            leading = flight is None
+            if leading:
+                flight = self.inflight[key] = _Flight()
+        if not leading:
+            # waiting without a timeout would block Ctrl-C
+            while not flight.done.wait(0.1):
+                pass
+            if flight.error is not None:
+                raise flight.error
+            return flight.response
+        try:
+            flight.response = send()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.inflight_lock:
+                del self.inflight[key]
+            flight.done.set()
+        return flight.response
+
+    def _request(self, method, path, params=None, query=None, headers=None,
+                 verbose=False, full=False, basic_auth=None, pre_formatted=None,
+                 decode=True, stream=False):
         # TODO: handle sending params as the body/payload for GET requests (e.g. ElasticSearch APIs use this)
+        started = time.time()
         # normalize the API parameters
         if method is None or method == '':
             method = 'get'
@@ -256,8 +373,9 @@ class RESTClient:
         for hdr_name in headers:
             hdr_value = headers[hdr_name]
             request_args['headers'].append((hdr_name, hdr_value))
-        for name in self.cookies:
-            request_args['headers'].append(('Cookie', '='.join([name, self.cookies[name]])))
+        cookies = self.session_cookies()
+        for name in cookies:
+            request_args['headers'].append(('Cookie', '='.join([name, cookies[name]])))
         if method == 'get':
             payload = ''
         else:
@@ -284,26 +402,58 @@ class RESTClient:
             sys.stderr.write('# Request Headers: %s\n' % str(headers))
             if self.oauth:
                 sys.stderr.write('# Oauth consumer key: %s\n' % self.oauth['consumer_key'])
-            if self.cookies:
-                sys.stderr.write('# Request Cookies: %s\n' % str(self.cookies))
-        try:
-            response = resource.request(method.upper(), **request_args)
-            response_data = response.body_string()
-        except RequestFailed as e:
-            response = e.response
-            response_data = e.message
-        except ResourceNotFound as e:
-            response = e.response
-            response_data = e.message
-        except Unauthorized as e:
-            response = e.response
-            response_data = e.message
+            if cookies:
+                sys.stderr.write('# Request Cookies: %s\n' % str(cookies))
+        profiling.add('build', time.time() - started)
+        # how cassettes know the request, whichever server it's for; any query typed in the path is already in query
+        request_path = path.split('?', 1)[0] + ('?' + query if query else '')
+        sent = time.time()
+        answered = None
+        if self.cassette is not None and self.cassette.playback:
+            # served from disk; the network is never touched
+            (response, response_data) = self.cassette.play(method, request_path, payload, stream)
+            answered = time.time()
+        else:
+            try:
+                response = profiling.timed('network', resource.request, method.upper(), **request_args)
+                answered = time.time()
+                if stream:
+                    # hand back the open body for the caller to read incrementally
+                    response_data = response.body_stream()
+                else:
+                    response_data = profiling.timed('network', response.body_string)
+            except RequestFailed as e:
+                response = e.response
+                response_data = e.message
+            except ResourceNotFound as e:
+                response = e.response
+                response_data = e.message
+            except Unauthorized as e:
+                response = e.response
+                response_data = e.message
+            if self.cassette is not None:
+                (response, response_data) = self.cassette.record(
+                    method, request_path, payload, response, response_data, stream
+                )
+        if stream:
+            # the body hasn't been read yet; go by what we were told to expect
+            size = int(response.headers.get('Content-Length') or 0)
+        else:
+            size = len(response_data or '')
+        finished = time.time()
+        self.stats.add(method, path, response.status_int, size, finished - started)
+        if self.har is not None:
+            self.har.add(
+                method, url, request_args['headers'], payload, response,
+                None if stream else response_data, started, sent, answered or finished, finished
+            )
         # see if we get a cookie back; note that we ignore the path
         for hdr_name, hdr_value in response.headerslist:
             if hdr_name.lower() == 'set-cookie':
                 cookies = Cookie.BaseCookie(hdr_value)
-                for name in cookies:
-                    self.cookies[name] = cookies[name].value
+                with self.cookies_lock:
+                    for name in cookies:
+                        self.cookies[name] = cookies[name].value
         if verbose:
             sys.stderr.write(
                 '# Response Status: %s\n# Response Headers: %s\n' % (
@@ -311,15 +461,23 @@ class RESTClient:
                 )
             )
         content_type = response.headers.get('Content-Type')
-        if not content_type or not content_type.startswith("application/json"):
+        if stream or not decode or not content_type or not content_type.startswith("application/json"):
+            # leave decoding to the caller if asked (e.g. to stream through the raw body)
             decoded = response_data
         else:
             try:
-                decoded = self.decode(response_data)
+                decoded = profiling.timed('decode', self.decode, response_data)
             except:
                 raise Exception('Failed to decode API response\n' + response_data)
-        response = Response(meta=response, decoded=decoded, raw=response_data)
+        response = Response(
+            meta=response,
+            decoded=decoded,
+            raw=response_data,
+            request=Request(method.upper(), url.split('?', 1)[0], query, list(request_args['headers']), payload or '')
+        )
         if response.meta.status_int < 200 or response.meta.status_int >= 400:
+            if stream:
+                response = self.read_body(response)
             raise APIException(
                 '"%s %s" failed (%s)' % (
                     method.upper(), path, response.meta.status
@@ -330,6 +488,23 @@ class RESTClient:
             return response
         return decoded
 
+    def read_body(self, response):
+        '''Read the rest of a streamed response (e.g. "request(..., stream=True, full=True)") and decode it, returning the full response.'''
+        if not hasattr(response.raw, 'read'):
+            return response
+        try:
+            response_data = profiling.timed('network', response.raw.read)
+        finally:
+            response.raw.close()
+        content_type = response.meta.headers.get('Content-Type')
+        decoded = response_data
+        if content_type and content_type.startswith("application/json"):
+            try:
+                decoded = profiling.timed('decode', self.decode, response_data)
+            except:
+                raise Exception('Failed to decode API response\n' + response_data)
+        return response._replace(decoded=decoded, raw=response_data)
+
     @classmethod
     def build_query_obj(cls, query, keep_blanks=True):
         '''Translates a query string into an object. If multiple keys are used the values will be contained in an array.'''
@@ -0,0 +1,148 @@
+"""An index of the API paths seen for each base URL, used for tab completion and cached on disk between sessions."""
+
+import collections
+import os
+import os.path
+import re
+import tempfile
+import threading
+import time
+try:
+    import json
+except:
+    import simplejson
+    json = simplejson
+
+
+def base_url(url):
+    '''Returns the base URL for a parsed client URL (see RESTClient.parse_url), without any trailing slash.'''
+    return '%s://%s:%s%s' % (url['scheme'], url['hostname'], url['port'], url['path'].rstrip('/'))
+
+
+def cache_file(directory, url):
+    '''Returns the path of the file within directory to cache the index for a base URL in.'''
+    return os.path.join(directory, re.sub(r'[^\w.-]+', '_', url) + '.json')
+
+
+class PathIndex(object):
+    """
+    The API paths seen below a base URL, as a tree of path segments.
+
+    Paths are learned from successful responses: the path requested, the IDs of records listed in the body (e.g. "users" => "users/42") and any links back into the API within it. The tree is loaded from and saved to a JSON file, so completion works straight away in later sessions.
+    """
+    # most entries kept per directory, so listings of huge collections don't swamp the index
+    max_children = 500
+    # most values looked at within a response body when searching for records/links
+    max_scan = 10000
+    # seconds before a directory is worth asking the server about again
+    refresh_after = 300
+
+    def __init__(self, url, cache_path=None):
+        self.url = url
+        self.base_path = re.sub(r'^\w+://[^/]+', '', url)
+        self.cache_path = cache_path
+        self.tree = {}
+        # directory => when we last asked the server about it
+        self.refreshed = {}
+        self.dirty = False
+        # responses may be learned from several threads at once (e.g. background jobs)
+        self.lock = threading.Lock()
+        if cache_path:
+            try:
+                with open(cache_path) as cache:
+                    self.tree = json.load(cache)
+            except (IOError, ValueError):
+                pass
+
+    def add(self, path):
+        '''Note an API path (e.g. "/users/42/profile"), relative to the base URL.'''
+        node = self.tree
+        with self.lock:
+            for name in path.split('?', 1)[0].split('/'):
+                if not name or name == '.':
+                    continue
+                if name not in node:
+                    if len(node) >= self.max_children:
+                        return
+                    node[name] = {}
+                    self.dirty = True
+                node = node[name]
+
+    def children(self, directory):
+        '''Returns (name, has_children) for each entry seen within a directory, sorted by name.'''
+        node = self.tree
+        with self.lock:
+            for name in directory.split('/'):
+                if name:
+                    node = node.get(name)
+                    if node is None:
+                        return []
+            return sorted((name, bool(child)) for (name, child) in node.items())
+
+    def relative_path(self, link):
+        '''Returns the API path a link within a response points to, if it's below our base URL.'''
+        if link.startswith(self.url + '/'):
+            return link[len(self.url):]
+        if link.startswith('/') and not link.startswith('//') and link.startswith(self.base_path + '/'):
+            return link[len(self.base_path):]
+        return None
+
+    def learn(self, path, decoded=None, headers=None):
+        '''Note a path that answered successfully, along with anything within its response that looks like another path.'''
+        self.add(path)
+        path = path.split('?', 1)[0].rstrip('/')
+        for link in re.findall(r'<([^>]+)>', (headers or {}).get('Link') or ''):
+            found = self.relative_path(link)
+            if found:
+                self.add(found)
+        if not isinstance(decoded, (list, dict)):
+            return
+        # records listed at the top level (e.g. [{"id": 3}] or {"items": [{"id": 3}]}) are probably below us
+        lists = [decoded] if isinstance(decoded, list) else \
+            [value for value in decoded.values() if isinstance(value, list)]
+        scanned = 0
+        for records in lists:
+            for record in records[:self.max_children]:
+                if isinstance(record, dict) and isinstance(record.get('id'), (basestring, int, long)):
+                    self.add('%s/%s' % (path, record['id']))
+        # search for links, breadth first so the most prominent are found before we give up
+        queue = collections.deque([decoded])
+        while queue and scanned < self.max_scan:
+            value = queue.popleft()
+            scanned += 1
+            if isinstance(value, dict):
+                queue.extend(value.values())
+            elif isinstance(value, list):
+                queue.extend(value)
+            elif isinstance(value, basestring) and '/' in value and ' ' not in value:
+                found = self.relative_path(value)
+                if found:
+                    self.add(found)
+
+    def needs_refresh(self, directory):
+        '''Whether we haven't asked the server about a directory lately; if so, it counts as asked about from now.'''
+        with self.lock:
+            if time.time() - self.refreshed.get(directory, 0) < self.refresh_after:
+                return False
+            self.refreshed[directory] = time.time()
+            return True
+
+    def save(self):
+        '''Write the index to its cache file if anything new was learned; failures are ignored, as it's only a cache.'''
+        if not self.cache_path or not self.dirty:
+            return
+        with self.lock:
+            encoded = json.dumps(self.tree)
+            self.dirty = False
+        try:
+            directory = os.path.dirname(self.cache_path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            # write then rename, so another session never reads half a file
+            (fd, tmp_path) = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'w') as cache:
+                cache.write(encoded)
+            os.rename(tmp_path, self.cache_path)
+        except (IOError, OSError):
+            pass
+
@@ -2,6 +2,7 @@
 
 """Uses python introspection to provide PHP-like "var_dump" functionality for debugging objects."""
 
+import itertools
 import sys
 import time
 import types
@@ -97,131 +98,230 @@ def print_tb():
     ])
 
 
-def obj2str(obj, depth=0, color=True, indent_char=' ', indent_size=4, inline=True, short_form=False, invert_color=False):
-    """Returns a formatted string, optionally with color coding"""
+class Renderer(object):
+    """
+    Renders objects as indented, optionally colored text, one chunk at a time.
+
+    Color escape sequences are computed once per palette entry and types are dispatched through a table, so each node costs a dictionary lookup rather than a full introspection. Types without a renderer fall back to describing the object via get_obj_info.
+
+    Output can be bounded for huge objects: lists and dicts show at most max_items entries followed by a count of what was left out, containers nested more than max_depth levels are collapsed to a one-line summary, and strings are cut off after max_string characters. The summaries only need each container's length, so the hidden parts are never walked.
+    """
+
+    color_reset = '\033[0;0m'
 
-    palette = light_colors if invert_color else dark_colors
+    def __init__(self, color=True, indent_char=' ', invert_color=False,
+                 max_depth=None, max_items=None, max_string=None):
+        palette = light_colors if invert_color else dark_colors
+        self.indent_char = indent_char
+        self.max_depth = max_depth
+        self.max_items = max_items
+        self.max_string = max_string
+        self.colors = {}
+        for (name, codes) in palette.iteritems():
+            if isinstance(codes, list):
+                self.colors[name] = [self.escapes(code, color) for code in codes]
+            else:
+                self.colors[name] = self.escapes(codes, color)
+        # JSON-ish types get rendered directly; 'long' is shown like an int
+        self.renderers = {
+            list: self.render_list,
+            dict: self.render_dict,
+            tuple: self.render_tuple,
+            inspect.ArgSpec: self.render_argspec,
+            str: self.scalar('str', self.truncate),
+            unicode: self.scalar('unicode', self.truncate),
+            bool: self.scalar('bool'),
+            int: self.scalar('int'),
+            long: self.scalar('int'),
+            float: self.scalar('float'),
+            types.NoneType: self.scalar('NoneType', lambda obj: '(none/null)'),
+            object: self.scalar('object', lambda obj: '(object)')
+        }
 
-    def shell_color(obj, obj_color):
+    def escapes(self, code, color):
         if color:
-            return '\033[%sm%s\033[0;0m' % (obj_color, unicode(obj))
+            return ('\033[%sm' % code, self.color_reset)
+        return ('', '')
+
+    def paint(self, text, name, depth=None):
+        if depth is None:
+            (start, end) = self.colors[name]
         else:
-            return unicode(obj)
-
-    def rdump(obj, depth=0, indent_size=4, inline=False, short_form=False):
-        if short_form:
-            return unicode(obj)[0:80 - (depth * indent_size)]
-        obj_info = get_obj_info(obj)
-        # indent ourselves
-        dump = depth * (indent_size * indent_char)
-        # see what we've got and recurse as needed
-        if obj_info['type'] == 'list':
-            if not len(obj):
-                dump += shell_color(' []', palette['object']) + '\n'
-            else:
-                skip_next_indent = True
-                for i in range(0, len(obj)):
-                    item = obj[i]
-                    item_info = get_obj_info(item)
-                    # handy any indentation we may need to do
-                    if skip_next_indent:
-                        skip_next_indent = False
-                    else:
-                        dump += depth * (indent_size * indent_char)
-                    # add in the key, cycling through the available colors based on depth
-                    dump += shell_color(i, palette[obj_info['type']][(depth) % (len(palette[obj_info['type']]))])
-                    # format it depending on whether we've nested list with any empty items
-                    if item_info['type'] in ('dict', 'tuple', 'list'):
-                        if not len(item):
-                            dump += rdump(item, 0, indent_size, True)
-                        else:
-                            dump += '\n' + rdump(item, depth + 1, indent_size, True)
-                    else:
-                        dump += rdump(item, 1, 1)
-        elif obj_info['type'] == 'dict':
-            if not len(obj):
-                dump += shell_color(' {}', palette['object']) + '\n'
-            else:
-                skip_next_indent = True
-                for key in obj:
-                    item = obj[key]
-                    item_info = get_obj_info(item)
-                    # handy any indentation we may need to do
-                    if skip_next_indent:
-                        skip_next_indent = False
-                    else:
-                        dump += depth * (indent_size * indent_char)
-                    # add in the key, cycling through the available colors based on depth
-                    dump += shell_color(key, palette[obj_info['type']][(depth) % (len(palette[obj_info['type']]))])
-                    # add in a bullet
-                    dump += shell_color(':', palette['bullet'])
-                    # format it depending on whether we've nested list with any empty items
-                    if item_info['type'] in ('dict', 'tuple', 'list'):
-                        if not len(item):
-                            dump += rdump(item, 0, indent_size, True)
-                        else:
-                            dump += '\n' + rdump(item, depth + 1, indent_size, True)
-                            if item_info['type'] == 'tuple':
-                                dump += '\n'
-                    else:
-                        dump += rdump(item, 1, 1)
-        elif obj_info['type'] == 'tuple':
-            if not len(obj):
-                dump += shell_color(' ()', palette['object'])
+            # cycle through the available colors based on depth
+            colors = self.colors[name]
+            (start, end) = colors[depth % len(colors)]
+        return start + text + end
+
+    def truncate(self, text):
+        text = unicode(text)
+        if self.max_string and len(text) > self.max_string:
+            return u'%s... (%s more chars)' % (
+                text[0:self.max_string],
+                '{:,}'.format(len(text) - self.max_string)
+            )
+        return text
+
+    def summary(self, obj):
+        if type(obj) is dict:
+            return ' {... %s keys}' % '{:,}'.format(len(obj))
+        if type(obj) is list:
+            return ' [... %s items]' % '{:,}'.format(len(obj))
+        return ' (... %s items)' % '{:,}'.format(len(obj))
+
+    def scalar(self, name, to_text=unicode):
+        (start, end) = self.colors[name]
+
+        def render(obj, depth, indent_size, inline, level=0):
+            text = depth * indent_size * self.indent_char + start + to_text(obj) + end
+            if not inline:
+                text += '\n'
+            return (text,)
+        return render
+
+    def render(self, obj, depth=0, indent_size=4, inline=False, level=0):
+        """Returns an iterable of text chunks for the object; level is how many containers deep the object is nested."""
+        renderer = self.renderers.get(type(obj), self.render_info)
+        return renderer(obj, depth, indent_size, inline, level)
+
+    def render_items(self, obj, items, depth, indent_size, inline, level):
+        indent = depth * indent_size * self.indent_char
+        container = type(obj).__name__
+        bullet = self.paint(':', 'bullet') if container == 'dict' else ''
+        if self.max_items and len(obj) > self.max_items:
+            items = itertools.islice(items, self.max_items)
+            hidden = len(obj) - self.max_items
+        else:
+            hidden = 0
+        collapse = self.max_depth and level + 1 >= self.max_depth
+        for (key, item) in items:
+            prefix = indent + self.paint(unicode(key), container, depth) + bullet
+            item_type = type(item)
+            # format it depending on whether we've nested list with any empty items
+            if item_type is dict or item_type is list or item_type is tuple:
+                if not len(item):
+                    yield prefix
+                    for chunk in self.render(item, 0, indent_size, True):
+                        yield chunk
+                elif collapse:
+                    yield prefix + self.paint(self.summary(item), 'seperator') + '\n'
+                else:
+                    yield prefix + '\n'
+                    for chunk in self.render(item, depth + 1, indent_size, True, level + 1):
+                        yield chunk
+                    if item_type is tuple and container == 'dict':
+                        yield '\n'
             else:
-                dump += shell_color('(', palette['bullet'])
-                dump += ', '.join([unicode(item)[0:32] for item in obj if item != ()])
-                dump += shell_color(')', palette['bullet'])
-        elif obj_info['type'] == 'str' or obj_info['type'] == 'unicode':
-            dump += shell_color(obj, palette[obj_info['type']])
-        elif obj_info['type'] == 'bool':
-            dump += shell_color(obj, palette[obj_info['type']])
-        elif obj_info['type'] == 'NoneType':
-            dump += shell_color('(none/null)', palette[obj_info['type']])
-        elif obj_info['type'] == 'int':
-            dump += shell_color(obj, palette[obj_info['type']])
-        elif obj_info['type'] == 'float':
-            dump += shell_color(obj, palette[obj_info['type']])
-        elif obj_info['type'] == 'object':
-            dump += shell_color('(object)', palette[obj_info['type']])
-        elif obj_info['type'] == 'instance':
-            dump += rdump(obj_info, depth)
-        elif obj_info['type'] == 'module':
-            dump += rdump(obj_info, depth)
-        elif obj_info['type'] == 'function':
-            dump += rdump(obj_info, depth)
-        elif obj_info['type'] == 'classobj':
-            dump += rdump(obj_info, depth)
-        elif obj_info['type'] == 'builtin_function_or_method':
-            dump += rdump(obj_info, depth)
-        elif obj_info['type'] == 'ArgSpec':
-            dump += '\n' + rdump({
-                'args': obj.args,
-                'varargs': obj.varargs,
-                'keywords': obj.keywords,
-                'defaults': obj.defaults,
-            }, depth + 1, inline=True)
+                yield prefix
+                for chunk in self.render(item, 1, 1):
+                    yield chunk
+        if hidden:
+            yield indent + self.paint('... %s more items' % '{:,}'.format(hidden), 'seperator') + '\n'
+        if not inline:
+            yield '\n'
+
+    def render_list(self, obj, depth, indent_size, inline, level=0):
+        if not len(obj):
+            return self.render_empty(' []', depth, indent_size, inline)
+        return self.render_items(obj, enumerate(obj), depth, indent_size, inline, level)
+
+    def render_dict(self, obj, depth, indent_size, inline, level=0):
+        if not len(obj):
+            return self.render_empty(' {}', depth, indent_size, inline)
+        return self.render_items(obj, obj.iteritems(), depth, indent_size, inline, level)
+
+    def render_empty(self, text, depth, indent_size, inline):
+        text = depth * indent_size * self.indent_char + self.paint(text, 'object') + '\n'
+        if not inline:
+            text += '\n'
+        return (text,)
+
+    def render_tuple(self, obj, depth, indent_size, inline, level=0):
+        text = depth * indent_size * self.indent_char
+        if not len(obj):
+            text += self.paint(' ()', 'object')
         else:
-            dump += rdump(obj_info, depth)
+            text += ''.join([
+                self.paint('(', 'bullet'),
+                ', '.join([unicode(item)[0:32] for item in obj if item != ()]),
+                self.paint(')', 'bullet')
+            ])
+        if not inline:
+            text += '\n'
+        return (text,)
+
+    def render_argspec(self, obj, depth, indent_size, inline, level=0):
+        yield depth * indent_size * self.indent_char + '\n'
+        for chunk in self.render({
+            'args': obj.args,
+            'varargs': obj.varargs,
+            'keywords': obj.keywords,
+            'defaults': obj.defaults,
+        }, depth + 1, inline=True):
+            yield chunk
+        if not inline:
+            yield '\n'
+
+    def render_info(self, obj, depth, indent_size, inline, level=0):
+        yield depth * indent_size * self.indent_char
+        for chunk in self.render(get_obj_info(obj), depth):
+            yield chunk
         if not inline:
-            dump += '\n'
-        return dump  # hack hack hack!
-    return rdump(obj, depth, indent_size, inline, short_form)
-
-
-def pretty_print(obj, depth=0, color=True, indent_char=' ', indent_size=4, stream=sys.stdout, invert_color=False):
-    """Pretty-prints the contents of the list, tupple, sequence, etc."""
-    output = obj2str(obj, depth, color, indent_char, indent_size, inline=True, invert_color=invert_color)
-    try:
-        output = output.encode(sys.stdout.encoding if sys.stdout.encoding else 'utf-8', 'ignore')
-    except Exception as e:
-        pass
-    if not output.endswith("\n"):
-        output = output + "\n"
-    try:
-        stream.write(output)
-    except:
-        pass
+            yield '\n'
+
+
+def iter_obj(obj, depth=0, color=True, indent_char=' ', indent_size=4, inline=True, invert_color=False, chunk_size=8192,
+             max_depth=None, max_items=None, max_string=None):
+    """Yields the formatted text of an object in chunks of roughly chunk_size characters, optionally with color coding."""
+    renderer = Renderer(color, indent_char, invert_color, max_depth, max_items, max_string)
+    chunks = []
+    size = 0
+    for chunk in renderer.render(obj, depth, indent_size, inline):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= chunk_size:
+            yield ''.join(chunks)
+            chunks = []
+            size = 0
+    if chunks:
+        yield ''.join(chunks)
+
+
+def obj2str(obj, depth=0, color=True, indent_char=' ', indent_size=4, inline=True, short_form=False, invert_color=False,
+            max_depth=None, max_items=None, max_string=None):
+    """Returns a formatted string, optionally with color coding"""
+    if short_form:
+        return unicode(obj)[0:80 - (depth * indent_size)]
+    return u''.join(iter_obj(
+        obj, depth, color, indent_char, indent_size, inline, invert_color,
+        max_depth=max_depth, max_items=max_items, max_string=max_string
+    ))
+
+
+def pretty_print(obj, depth=0, color=True, indent_char=' ', indent_size=4, stream=None, invert_color=False,
+                 max_depth=None, max_items=None, max_string=None):
+    """Pretty-prints the contents of the list, tupple, sequence, etc., writing the output as it is rendered. See Renderer for the max_* limits."""
+    if stream is None:
+        stream = sys.stdout
+    encoding = getattr(stream, 'encoding', None) or 'utf-8'
+    last = ''
+    for chunk in iter_obj(obj, depth, color, indent_char, indent_size, inline=True, invert_color=invert_color,
+                          max_depth=max_depth, max_items=max_items, max_string=max_string):
+        if not chunk:
+            continue
+        last = chunk
+        try:
+            chunk = chunk.encode(encoding, 'ignore')
+        except Exception as e:
+            pass
+        try:
+            stream.write(chunk)
+        except:
+            pass
+    if not last.endswith("\n"):
+        try:
+            stream.write("\n")
+        except:
+            pass
 
 pp = pretty_print
 
@@ -0,0 +1,247 @@
+"""
+A local HTTP server for canned payloads, to benchmark the client without a network (see "serve-fixtures").
+
+Files are served from a directory. Paths under /_gen/ (json, ndjson, html, xml) are generated payloads of a given size. Latency, status, chunking, gzip compression and Link-header pagination can be set for the whole server or per request with query parameters (e.g. "/_gen/json?size=1MB&latency=50ms&per_page=100&page=2").
+"""
+
+from cStringIO import StringIO
+import BaseHTTPServer
+import SocketServer
+import gzip
+import mimetypes
+import os
+import os.path
+import sys
+import threading
+import time
+import urllib
+import urlparse
+try:
+    import json
+except:
+    import simplejson
+    json = simplejson
+
+import util
+
+
+content_types = {
+    '.json': 'application/json',
+    '.ndjson': 'application/x-ndjson',
+    '.html': 'text/html',
+    '.xml': 'application/xml'
+}
+
+
+def generate(kind, size):
+    '''Returns (content type, body) for a generated payload of about size bytes: "json" (an object with a list of records under "items"), "ndjson", "html" or "xml".'''
+    parts = []
+    length = 0
+    i = 0
+    if kind == 'json':
+        (start, end, separator) = ('{"items": [', ']}', ', ')
+    elif kind == 'ndjson':
+        (start, end, separator) = ('', '', '\n')
+    elif kind == 'html':
+        (start, end, separator) = ('<html><body><ul>\n', '</ul></body></html>\n', '\n')
+    elif kind == 'xml':
+        (start, end, separator) = ('<?xml version="1.0"?>\n<items>\n', '</items>\n', '\n')
+    else:
+        return (None, None)
+    while length < size:
+        if kind in ('json', 'ndjson'):
+            # formatted by hand; encoding each record would make large payloads slow to prepare
+            part = '{"active": %s, "href": "/items/%d", "id": %d, "name": "item %d", "score": %s, "tags": ["fixture", "tag-%d"]}' % (
+                'true' if i % 2 == 0 else 'false', i, i, i, i * 0.5, i % 10
+            )
+        elif kind == 'html':
+            part = '<li class="item" id="item-%d"><a href="/items/%d">Item %d</a> <span class="score">%s</span></li>' % (
+                i, i, i, i * 0.5
+            )
+        else:
+            part = '<item id="%d"><name>Item %d</name><score>%s</score></item>' % (i, i, i * 0.5)
+        parts.append(part)
+        length += len(part) + len(separator)
+        i += 1
+    return (content_types['.' + kind], start + separator.join(parts) + end)
+
+
+class FixtureServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Serves the fixtures in a directory, with defaults for the options requests may override."""
+    daemon_threads = True
+    allow_reuse_address = True
+    # most payloads kept prepared (e.g. generated or compressed), least recently used first
+    max_cached = 32
+
+    def __init__(self, address, directory, latency=0.0, size=1024 * 1024, status=200,
+                 chunk_size=None, compress=False, per_page=None, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, FixtureHandler)
+        self.directory = os.path.realpath(directory)
+        self.latency = latency
+        self.size = size
+        self.status = status
+        # if set, bodies are sent with chunked transfer encoding in chunks of this size
+        self.chunk_size = chunk_size
+        self.compress = compress
+        self.per_page = per_page
+        self.verbose = verbose
+        # key => prepared value, so preparing them doesn't count towards what's being benchmarked
+        self.cache = {}
+        self.cache_order = []
+        self.lock = threading.Lock()
+
+    def cached(self, key, make):
+        '''Returns the value cached for key, making (and caching) it first if needed.'''
+        with self.lock:
+            if key in self.cache:
+                self.cache_order.remove(key)
+                self.cache_order.append(key)
+                return self.cache[key]
+        value = make()
+        with self.lock:
+            if key not in self.cache:
+                self.cache_order.append(key)
+            self.cache[key] = value
+            while len(self.cache_order) > self.max_cached:
+                del self.cache[self.cache_order.pop(0)]
+        return value
+
+    def payload(self, path, size):
+        '''Returns (content type, body) for a path, or (None, None) if there's nothing there.'''
+        if path.startswith('/_gen/'):
+            kind = path[len('/_gen/'):].strip('/')
+            return self.cached(('gen', kind, size), lambda: generate(kind, size))
+        file_path = os.path.realpath(os.path.join(self.directory, urllib.unquote(path).lstrip('/')))
+        if file_path != self.directory and not file_path.startswith(self.directory + os.sep):
+            # e.g. "/../../etc/passwd"
+            return (None, None)
+        if os.path.isdir(file_path):
+            for index in ('index.json', 'index.html'):
+                if os.path.isfile(os.path.join(file_path, index)):
+                    file_path = os.path.join(file_path, index)
+                    break
+        if not os.path.isfile(file_path):
+            return (None, None)
+
+        def read():
+            with open(file_path, 'rb') as source:
+                body = source.read()
+            extension = os.path.splitext(file_path)[1].lower()
+            return (
+                content_types.get(extension) or mimetypes.guess_type(file_path)[0] or 'application/octet-stream',
+                body
+            )
+
+        return self.cached(('file', file_path, os.path.getmtime(file_path)), read)
+
+    def paginate(self, path, size, body, page, per_page):
+        '''Returns a page of the records in a JSON body (a list, or an object with a list under "items"), along with the number of pages.'''
+        records = self.cached(('records', path, size, len(body)), lambda: json.loads(body))
+        items = records if isinstance(records, list) else records.get('items')
+        if not isinstance(items, list):
+            return (body, None)
+        pages = max(1, (len(items) + per_page - 1) // per_page)
+        chosen = items[(page - 1) * per_page:page * per_page]
+        if isinstance(records, list):
+            return (json.dumps(chosen), pages)
+        paged = dict(records)
+        paged['items'] = chosen
+        return (json.dumps(paged), pages)
+
+    def compressed(self, key, body):
+        def make():
+            buffer = StringIO()
+            with gzip.GzipFile(fileobj=buffer, mode='wb') as out:
+                out.write(body)
+            return buffer.getvalue()
+        return self.cached(('gzip', key, len(body)), make)
+
+
+class FixtureHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers every method the same way, after reading (and ignoring) any request body."""
+    # keep connections open, so the client's pooling gets exercised
+    protocol_version = 'HTTP/1.1'
+
+    def respond(self):
+        server = self.server
+        parsed = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(parsed.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        try:
+            latency = util.parse_duration(query['latency']) if 'latency' in query else server.latency
+            size = util.parse_size(query['size']) if 'size' in query else server.size
+            status = int(query.get('status', server.status))
+            chunk_size = util.parse_size(query['chunked']) if query.get('chunked') else server.chunk_size
+            compress = query['gzip'] not in ('0', 'false') if 'gzip' in query else server.compress
+            per_page = int(query['per_page']) if 'per_page' in query else server.per_page
+            page = max(1, int(query.get('page', 1)))
+        except Exception as e:
+            return self.send_body(400, 'application/json', json.dumps({'error': str(e)}))
+        (content_type, body) = server.payload(parsed.path, size)
+        if body is None:
+            return self.send_body(404, 'application/json', json.dumps({'error': 'Not found: %s' % parsed.path}))
+        headers = []
+        if per_page and content_type == 'application/json':
+            (body, pages) = server.paginate(parsed.path, size, body, page, per_page)
+            if pages is not None:
+                headers.append(('Link', self.links(parsed.path, query, page, pages)))
+        if compress and 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            body = server.compressed((parsed.path, size, page, per_page), body)
+            headers.append(('Content-Encoding', 'gzip'))
+        if latency:
+            time.sleep(latency)
+        self.send_body(status, content_type, body, headers, chunk_size)
+
+    def links(self, path, query, page, pages):
+        '''Returns a Link header pointing to the first, previous, next and last pages.'''
+        links = []
+        for (rel, number) in (('first', 1), ('prev', page - 1), ('next', page + 1), ('last', pages)):
+            if 1 <= number <= pages:
+                query = dict(query, page=number)
+                links.append('<%s?%s>; rel="%s"' % (path, urllib.urlencode(sorted(query.items())), rel))
+        return ', '.join(links)
+
+    def send_body(self, status, content_type, body, headers=None, chunk_size=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for (name, value) in headers or []:
+            self.send_header(name, value)
+        if chunk_size:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        if not chunk_size:
+            self.wfile.write(body)
+            return
+        for start in xrange(0, len(body), chunk_size):
+            chunk = body[start:start + chunk_size]
+            self.wfile.write('%x\r\n%s\r\n' % (len(chunk), chunk))
+        self.wfile.write('0\r\n\r\n')
+
+    do_GET = do_HEAD = do_POST = do_PUT = do_PATCH = do_DELETE = do_OPTIONS = respond
+
+    def log_message(self, format, *args):
+        # logging every request would slow down (and drown out) benchmarks
+        if self.server.verbose:
+            sys.stderr.write('# %s\n' % (format % args))
+
+
+def serve(directory, host='127.0.0.1', port=8000, **options):
+    '''Serve the fixtures in directory until interrupted (see FixtureServer for the options).'''
+    if not os.path.isdir(directory):
+        raise Exception('No such directory: %s' % directory)
+    server = FixtureServer((host, port), directory, **options)
+    sys.stderr.write('Serving %s on http://%s:%d/ (generated payloads under /_gen/json, ndjson, html, xml); Ctrl-C to stop.\n' % (
+        directory, host, server.server_address[1]
+    ))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        sys.stderr.write('\n')
+    finally:
+        server.server_close()
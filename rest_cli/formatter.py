@@ -1,80 +1,303 @@
-import subprocess
+"""Line-based output formatters that chain together like a shell pipeline (e.g. head, tail, grep, sort, uniq)."""
 
+import collections
+import heapq
+import itertools
+import re
+import tempfile
 
-def find_subclasses(cls):
-    '''
-    Find all subclasses of given class
-   cls - Any class whose subclass to be found
-    '''
-    subclasses = None
-    try:
-        subclasses = cls.__subclasses__()
-        for d in list(subclasses):
-            subclasses.extend(find_subclasses(d))
-    except:
-        pass
-    return subclasses
+
+# formatter name => class, filled in by @register
+formatters = {}
+
+
+def register(klass):
+    '''Add a formatter class to the table of formatters available for chaining, by its lower-case name.'''
+    formatters[klass.__name__.lower()] = klass
+    return klass
+
+
+def iter_lines(text):
+    '''Yield the lines within a string without splitting it all up front.'''
+    start = 0
+    while True:
+        end = text.find('\n', start)
+        if end == -1:
+            if start < len(text):
+                yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+
+def lines_from_chunks(chunks):
+    '''Yield complete lines from an iterable of text chunks (e.g. rendered output), as the chunks arrive.'''
+    partial = ''
+    for chunk in chunks:
+        lines = (partial + chunk).split('\n')
+        partial = lines.pop()
+        for line in lines:
+            yield line
+    if partial:
+        yield partial
 
 
 class OutputFormatter(object):
+    """
+    Wraps a stream of lines; calling a formatter transforms the stream and returns the formatter for chaining (e.g. "OutputFormatter(text).head(20).grep('id')").
+
+    Lines are pulled through the chain lazily, so nothing is read or rendered until the output is consumed, and formatters like 'head' stop consuming their input as soon as they have what they need.
+    """
     terminal = False
 
     def __init__(self, text):
-        if type(text) == list:
-            self.lines = text
+        if isinstance(text, basestring):
+            self.lines = iter_lines(text)
         else:
-            self.lines = text.splitlines()
+            self.lines = iter(text)
+
+    @classmethod
+    def parse_args(cls, argv):
+        '''Translate command-line style arguments (e.g. from the shell: "| head -n 20") into keyword arguments for the formatter.'''
+        if argv:
+            raise Exception('The "%s" formatter takes no arguments.' % cls.__name__.lower())
+        return {}
 
     def __getattr__(self, name):
-        klass = self.__class__
-        klasses = []
+        if name.startswith('__'):
+            raise AttributeError(name)
         if self.terminal:
             raise Exception('Unable to chain formatter "%s"; "%s" is terminal' % (
-                name, klass.__name__.lower()
+                name, self.__class__.__name__.lower()
             ))
-        while klass is not OutputFormatter:
-            [klasses.append(kls) for kls in klass.__bases__]
-            if klasses:
-                klass = klasses.pop()
-            else:
-                raise Exception("I'm lost and failed to find myself somehow.")
-        for formatter in find_subclasses(klass):
-            if formatter.__name__.lower() == name.lower():
-                return formatter(self.lines[:])
-        raise KeyError('formatter not found: %s' % name)
+        if name.lower() not in formatters:
+            raise KeyError('formatter not found: %s' % name)
+        return formatters[name.lower()](self.lines)
+
+    def __iter__(self):
+        return self.lines
 
     def __str__(self):
         return '\n'.join(self.lines)
 
 
+def _count_arg(argv, flags, name):
+    '''Pull a numeric option (e.g. "-n 20", "-20" or "20") out of an argument list.'''
+    opts = {}
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg in flags:
+            i += 1
+            if i == len(argv):
+                raise Exception('Missing value for %s.' % arg)
+            opts[flags[arg]] = int(argv[i])
+        elif re.match(r'^-?\d+$', arg):
+            opts[name] = abs(int(arg))
+        else:
+            raise Exception('Unrecognized argument: %s' % arg)
+        i += 1
+    return opts
+
+
+@register
 class Head(OutputFormatter):
+    """The first n lines, or first c characters."""
+
+    @classmethod
+    def parse_args(cls, argv):
+        return _count_arg(argv, {'-n': 'n', '-c': 'c'}, 'n')
+
     def __call__(self, n=10, c=None):
         if c:
-            lines = []
-            left = c
-            for line in self.lines:
-                if len(line) < left:
-                    # clear to add the entire line
-                    lines.append(line)
-                else:
-                    # append only whats remaining to be read
-                    lines.append(line[:len(line) - left])
-                left -= len(lines[-1])
-                if left <= 0:
-                    break
-            self.lines = lines
+            self.lines = self._chars(self.lines, c)
         if n:
-            self.lines = self.lines[:n]
+            self.lines = itertools.islice(self.lines, n)
         return self
 
+    @staticmethod
+    def _chars(lines, left):
+        for line in lines:
+            if len(line) >= left:
+                # append only whats remaining to be read
+                yield line[:left]
+                return
+            yield line
+            left -= len(line)
+
+
+@register
+class Tail(OutputFormatter):
+    """The last n lines, or last c characters. Only as many lines as needed are held in memory."""
+
+    @classmethod
+    def parse_args(cls, argv):
+        return _count_arg(argv, {'-n': 'n', '-c': 'c'}, 'n')
 
-class Tail(Head):
     def __call__(self, n=10, c=None):
-        head = self.head
-        head.lines.reverse()
-        head(n, c)
-        self.lines = head.lines
-        self.lines.reverse()
+        if c:
+            self.lines = self._chars(self.lines, c)
+        if n:
+            self.lines = self._last(self.lines, n)
+        return self
+
+    @staticmethod
+    def _last(lines, n):
+        for line in collections.deque(lines, maxlen=n):
+            yield line
+
+    @staticmethod
+    def _chars(lines, count):
+        kept = collections.deque()
+        total = 0
+        for line in lines:
+            kept.append(line)
+            total += len(line)
+            # drop whole lines we no longer need
+            while total - len(kept[0]) >= count:
+                total -= len(kept.popleft())
+        if kept and total > count:
+            kept[0] = kept[0][total - count:]
+        for line in kept:
+            yield line
+
+
+@register
+class Grep(OutputFormatter):
+    """Lines matching (or with v=True, not matching) a regular expression."""
+
+    @classmethod
+    def parse_args(cls, argv):
+        opts = {}
+        for arg in argv:
+            if arg == '-v':
+                opts['v'] = True
+            elif arg == '-i':
+                opts['i'] = True
+            elif 'pattern' not in opts:
+                opts['pattern'] = arg
+            else:
+                raise Exception('Unrecognized argument: %s' % arg)
+        if 'pattern' not in opts:
+            raise Exception('Missing pattern to grep for.')
+        return opts
+
+    def __call__(self, pattern, v=False, i=False):
+        regex = re.compile(pattern, re.I if i else 0)
+        if v:
+            self.lines = (line for line in self.lines if not regex.search(line))
+        else:
+            self.lines = (line for line in self.lines if regex.search(line))
+        return self
+
+
+class _Reversed(object):
+    '''Inverts the ordering of a sort key, for merging in descending order.'''
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
+
+
+@register
+class Sort(OutputFormatter):
+    """
+    Lines in sorted order, optionally numerically (n) and/or reversed (r).
+
+    Up to buffer_lines lines are sorted in memory; past that, sorted runs are written to temporary files and merged, so large outputs don't need to fit in memory.
+    """
+    buffer_lines = 100000
+
+    @classmethod
+    def parse_args(cls, argv):
+        opts = {}
+        for arg in argv:
+            if arg.startswith('-') and len(arg) > 1 and set(arg[1:]) <= set('nr'):
+                for flag in arg[1:]:
+                    opts[flag] = True
+            else:
+                raise Exception('Unrecognized argument: %s' % arg)
+        return opts
+
+    @staticmethod
+    def numeric_key(line):
+        match = re.match(r'\s*(-?\d+(\.\d*)?)', line)
+        return float(match.group(1)) if match else 0.0
+
+    def __call__(self, n=False, r=False):
+        key = self.numeric_key if n else None
+        self.lines = self._sort(self.lines, key, r)
+        return self
+
+    def _sort(self, lines, key, reverse):
+        runs = []
+        try:
+            while True:
+                chunk = list(itertools.islice(lines, self.buffer_lines))
+                if not chunk:
+                    break
+                chunk.sort(key=key, reverse=reverse)
+                if not runs and len(chunk) < self.buffer_lines:
+                    # it all fit in memory
+                    for line in chunk:
+                        yield line
+                    return
+                runs.append(self._spill(chunk))
+            decorate = key or (lambda line: line)
+            if reverse:
+                wrap = lambda line: (_Reversed(decorate(line)), line)
+            else:
+                wrap = lambda line: (decorate(line), line)
+            merged = heapq.merge(*[
+                itertools.imap(wrap, self._read(run)) for run in runs
+            ])
+            for (sort_key, line) in merged:
+                yield line
+        finally:
+            for run in runs:
+                run.close()
+
+    @staticmethod
+    def _spill(lines):
+        run = tempfile.TemporaryFile()
+        for line in lines:
+            if isinstance(line, unicode):
+                line = line.encode('utf-8')
+            run.write(line + '\n')
+        run.seek(0)
+        return run
+
+    @staticmethod
+    def _read(run):
+        for line in run:
+            yield line[:-1].decode('utf-8')
+
+
+@register
+class Uniq(OutputFormatter):
+    """Lines with adjacent duplicates collapsed, optionally prefixed by how many times they occured (c)."""
+
+    @classmethod
+    def parse_args(cls, argv):
+        opts = {}
+        for arg in argv:
+            if arg == '-c':
+                opts['c'] = True
+            else:
+                raise Exception('Unrecognized argument: %s' % arg)
+        return opts
+
+    def __call__(self, c=False):
+        if c:
+            self.lines = (
+                '%7d %s' % (sum(1 for dupe in dupes), line)
+                for (line, dupes) in itertools.groupby(self.lines)
+            )
+        else:
+            self.lines = (line for (line, dupes) in itertools.groupby(self.lines))
         return self
 
 
@@ -82,12 +305,14 @@ if __name__ == '__main__':
     # testing...
     data = '1a\n2b\n3c\n4d\n5e\n6f\n7g\n8h\n9i\n10j\n11k\n'
     print '* first 3 lines'
-    outf = OutputFormatter(data)
-    print outf.head(3)
+    print OutputFormatter(data).head(3)
     print '* 3rd line'
     print Head(data)(3).tail(1)
     print '* last 3 lines'
-    print outf.tail(3)
+    print OutputFormatter(data).tail(3)
     print '* 3rd to last lines'
     print Tail(data)(3).head(1)
-    print outf.less()
+    print '* lines with a 1, reverse numeric order'
+    print OutputFormatter(data).grep('1').sort(n=True, r=True)
+    print '* unique lines, counted'
+    print OutputFormatter('a\na\nb\na\n').uniq(c=True)
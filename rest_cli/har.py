@@ -0,0 +1,269 @@
+"""Record requests to HAR (HTTP Archive) files, and replay them with their original timing as a load test."""
+
+import Queue
+import calendar
+import re
+import sys
+import threading
+import time
+import urlparse
+try:
+    import json
+except:
+    import simplejson
+    json = simplejson
+
+from restkit import Resource
+from restkit.errors import RequestFailed, ResourceNotFound, Unauthorized
+
+import stats
+import util
+
+
+def iso_time(when):
+    '''Returns a timestamp in the ISO 8601 form HAR uses (e.g. "2014-06-01T12:00:00.123Z").'''
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(when)) + '.%03dZ' % (when % 1 * 1000)
+
+
+def parse_iso_time(text):
+    '''Returns the epoch time for an ISO 8601 timestamp, as written by browsers and iso_time.'''
+    match = re.match(r'^(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(\.\d+)?(Z|[+-]\d\d:?\d\d)?$', text)
+    if not match:
+        raise Exception('Invalid HAR timestamp: "%s".' % text)
+    when = calendar.timegm(time.strptime(match.group(1), '%Y-%m-%dT%H:%M:%S'))
+    when += float(match.group(2) or 0)
+    offset = (match.group(3) or 'Z').replace(':', '')
+    if offset != 'Z':
+        when -= int(offset[0] + '1') * (int(offset[1:3]) * 3600 + int(offset[3:5]) * 60)
+    return when
+
+
+def _pairs(items):
+    return [{'name': name, 'value': value} for (name, value) in items]
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3)
+
+
+class Recorder(object):
+    """
+    Collects the requests made by a RESTClient (see RESTClient.har) and writes them to a HAR file.
+
+    Bodies larger than max_text are recorded by size only, so recording a session of big downloads doesn't hold them all in memory.
+    """
+    max_text = 1024 * 1024
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = []
+        # requests may be made from several threads at once (e.g. background jobs)
+        self.lock = threading.Lock()
+
+    def add(self, method, url, headers, payload, response, body, started, sent, answered, finished):
+        '''
+        Record an exchange. Times are epoch seconds: when the request began to be built, was sent, its response headers arrived and its body was read.
+
+        The body is None if it was streamed to the caller rather than read.
+        '''
+        content_type = response.headers.get('Content-Type') or ''
+        content = {'mimeType': content_type}
+        if body is None:
+            content['size'] = int(response.headers.get('Content-Length') or -1)
+            content['comment'] = 'Streamed; not recorded.'
+        else:
+            content['size'] = len(body)
+            if len(body) <= self.max_text:
+                content['text'] = body.decode('utf-8', 'replace') if isinstance(body, str) else body
+            else:
+                content['comment'] = 'Larger than %s; not recorded.' % util.format_size(self.max_text)
+        (status, reason) = (response.status.split(' ', 1) + [''])[:2]
+        request = {
+            'method': method.upper(),
+            'url': url,
+            'httpVersion': 'HTTP/1.1',
+            'headers': _pairs(headers),
+            'queryString': _pairs(urlparse.parse_qsl(urlparse.urlparse(url).query, True)),
+            'cookies': [],
+            'headersSize': -1,
+            'bodySize': len(payload or '')
+        }
+        if payload:
+            request['postData'] = {
+                'mimeType': dict((name.lower(), value) for (name, value) in headers).get('content-type', ''),
+                'text': payload
+            }
+        entry = {
+            'startedDateTime': iso_time(started),
+            'time': _ms(finished - started),
+            'request': request,
+            'response': {
+                'status': int(status),
+                'statusText': reason,
+                'httpVersion': 'HTTP/1.1',
+                'headers': _pairs(response.headerslist),
+                'cookies': [],
+                'content': content,
+                'redirectURL': response.headers.get('Location') or '',
+                'headersSize': -1,
+                'bodySize': content['size']
+            },
+            'cache': {},
+            # restkit sends the request and reads the response headers in one go, so "wait" covers both
+            'timings': {
+                'blocked': _ms(sent - started),
+                'dns': -1,
+                'connect': -1,
+                'send': 0,
+                'wait': _ms(answered - sent),
+                'receive': _ms(finished - answered),
+                'ssl': -1
+            }
+        }
+        with self.lock:
+            self.entries.append(entry)
+
+    def save(self):
+        '''Write everything recorded so far to the HAR file.'''
+        with self.lock:
+            entries = sorted(self.entries, key=lambda entry: entry['startedDateTime'])
+        har = {
+            'log': {
+                'version': '1.2',
+                'creator': {'name': 'rest-cli', 'version': '1.0'},
+                'pages': [],
+                'entries': entries
+            }
+        }
+        with open(self.path, 'w') as out:
+            json.dump(har, out, indent=1)
+
+
+def load(path):
+    '''Returns the entries of a HAR file, oldest first.'''
+    try:
+        with open(path) as source:
+            entries = json.load(source)['log']['entries']
+    except (IOError, ValueError, KeyError, TypeError) as e:
+        raise Exception('Failed to read HAR file "%s": %s' % (path, e))
+    for entry in entries:
+        entry['started'] = parse_iso_time(entry['startedDateTime'])
+    return sorted(entries, key=lambda entry: entry['started'])
+
+
+def send(entry, origin=None):
+    '''Make a recorded request again, optionally to another origin (e.g. "http://staging:8080"); returns (status, seconds taken).'''
+    request = entry['request']
+    url = request['url']
+    if origin:
+        url = origin.rstrip('/') + re.sub(r'^\w+://[^/]+', '', url)
+    # let the connection work these out for itself
+    headers = [
+        (header['name'], header['value']) for header in request.get('headers', [])
+        if header['name'].lower() not in ('content-length', 'host', 'connection')
+    ]
+    payload = (request.get('postData') or {}).get('text') or None
+    if isinstance(payload, unicode):
+        payload = payload.encode('utf-8')
+    started = time.time()
+    try:
+        response = Resource(url).request(request['method'], payload=payload, headers=headers)
+        response.body_string()
+    except (RequestFailed, ResourceNotFound, Unauthorized) as e:
+        # the body has already been read into the error
+        response = e.response
+    return (response.status_int, time.time() - started)
+
+
+class Replay(object):
+    """
+    Replays HAR entries with the gaps between them divided by speed, using up to concurrency requests at once.
+
+    Requests are sent at their scheduled time unless every connection is busy, in which case they're late; how late is reported, since a replay that can't keep up isn't the load that was recorded.
+    """
+
+    def __init__(self, entries, speed=1.0, concurrency=10, origin=None):
+        self.entries = entries
+        self.speed = speed
+        self.concurrency = concurrency
+        self.origin = origin
+        # per entry: (status or None, seconds taken, seconds late, error)
+        self.results = [None] * len(entries)
+
+    def run(self):
+        queue = Queue.Queue()
+        first = self.entries[0]['started'] if self.entries else 0
+        began = time.time()
+
+        def work():
+            while True:
+                item = queue.get()
+                if item is None:
+                    return
+                (i, due) = item
+                late = max(time.time() - due, 0.0)
+                try:
+                    (status, elapsed) = send(self.entries[i], self.origin)
+                    self.results[i] = (status, elapsed, late, None)
+                except Exception as e:
+                    self.results[i] = (None, 0.0, late, e)
+
+        threads = [threading.Thread(target=work) for n in range(max(1, self.concurrency))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for (i, entry) in enumerate(self.entries):
+            due = began + (entry['started'] - first) / self.speed
+            if due > time.time():
+                time.sleep(due - time.time())
+            queue.put((i, due))
+        for thread in threads:
+            queue.put(None)
+        for thread in threads:
+            # joining without a timeout would block Ctrl-C
+            while thread.is_alive():
+                thread.join(0.1)
+        return time.time() - began
+
+    def report(self, elapsed, out=None):
+        '''Print how the replay's latencies compare with the recording's, overall and by endpoint (slowest in the replay first).'''
+        out = out or sys.stdout
+        done = [(entry, result) for (entry, result) in zip(self.entries, self.results) if result]
+        errors = [result[3] for (entry, result) in done if result[3] is not None]
+        changed = [
+            entry for (entry, result) in done
+            if result[0] is not None and result[0] != entry['response'].get('status')
+        ]
+        late = [result[2] for (entry, result) in done]
+        out.write('Replayed %d requests in %.2fs at %gx speed, %d at a time; %d failed, %d returned a different status.\n' % (
+            len(done), elapsed, self.speed, self.concurrency, len(errors), len(changed)
+        ))
+        if late:
+            out.write('Sent late by up to %.3fs (mean %.3fs).\n' % (max(late), sum(late) / len(late)))
+        for error in sorted(set(str(error) for error in errors))[:5]:
+            out.write('! %s\n' % error)
+        # (method, path template) => ([recorded seconds], [replayed seconds])
+        endpoints = {}
+        for (entry, result) in done:
+            if result[3] is not None:
+                continue
+            key = (entry['request']['method'], stats.template(urlparse.urlparse(entry['request']['url']).path))
+            (recorded, replayed) = endpoints.setdefault(key, ([], []))
+            recorded.append(entry['time'] / 1000.0)
+            replayed.append(result[1])
+        out.write('%-7s %-32s %6s %9s %9s %9s %9s %9s\n' % (
+            'METHOD', 'PATH', 'COUNT', 'REC MEAN', 'MEAN', 'DELTA', 'REC P95', 'P95'
+        ))
+        rows = sorted(endpoints.items(), key=lambda item: -sum(item[1][1]) / len(item[1][1]))
+        for ((method, path), (recorded, replayed)) in rows:
+            recorded_mean = sum(recorded) / len(recorded)
+            replayed_mean = sum(replayed) / len(replayed)
+            out.write('%-7s %-32s %6d %8.3fs %8.3fs %+8.3fs %8.3fs %8.3fs\n' % (
+                method, path, len(replayed), recorded_mean, replayed_mean,
+                replayed_mean - recorded_mean, _percentile(recorded, 95), _percentile(replayed, 95)
+            ))
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
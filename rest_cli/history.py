@@ -0,0 +1,186 @@
+"""A bounded history of responses for replaying them later; older bodies are compressed and moved to disk."""
+
+import atexit
+import collections
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+try:
+    import json
+except:
+    import simplejson
+    json = simplejson
+
+import client
+
+
+class Entry(object):
+    """
+    A response in the history, along with the request it answered (see client.Request).
+
+    The response body and request payload are kept in memory until spilled to disk, and the body is only decoded when asked for.
+    """
+
+    def __init__(self, id, method, path, status, headerslist, body, elapsed, request=None):
+        self.id = id
+        self.method = method
+        self.path = path
+        self.status = status
+        self.headerslist = headerslist
+        self.elapsed = elapsed
+        self.time = time.time()
+        self.size = len(body) if body is not None else 0
+        self._body = body
+        # the request's final query and headers; its payload is kept (and spilled) like the body
+        self.query = request.query if request else ''
+        self.request_headers = list(request.headers) if request else []
+        self._payload = request.payload if request else ''
+        # what the entry holds in memory until spilled
+        self.bytes = self.size + len(self._payload)
+        # where the compressed body (and payload, if any) live once spilled
+        self.spill_path = None
+
+    def spill(self, directory):
+        '''Move the body and payload out of memory into compressed files within the directory.'''
+        self.spill_path = os.path.join(directory, '%d.z' % self.id)
+        if self._body is not None:
+            with open(self.spill_path, 'wb') as spill:
+                spill.write(zlib.compress(self._body))
+        if self._payload:
+            with open(self.spill_path + '.payload', 'wb') as spill:
+                spill.write(zlib.compress(self._payload))
+        self._body = None
+        self._payload = None
+
+    def forget(self):
+        if self.spill_path:
+            for path in (self.spill_path, self.spill_path + '.payload'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        self._body = None
+        self._payload = None
+
+    @property
+    def body(self):
+        if self.spill_path:
+            try:
+                with open(self.spill_path, 'rb') as spill:
+                    return zlib.decompress(spill.read())
+            except IOError:
+                # it was streamed, so never kept
+                return None
+        return self._body
+
+    @property
+    def payload(self):
+        if self.spill_path:
+            try:
+                with open(self.spill_path + '.payload', 'rb') as spill:
+                    return zlib.decompress(spill.read())
+            except IOError:
+                # nothing was sent
+                return ''
+        return self._payload
+
+    @property
+    def request_path(self):
+        '''The path requested, with its final query.'''
+        return self.path.split('?', 1)[0] + ('?' + self.query if self.query else '')
+
+    def response(self):
+        '''Returns the entry as a client Response, as if it had just been received.'''
+        meta = client.StoredMeta(self.status, self.headerslist)
+        body = self.body
+        decoded = body
+        content_type = meta.headers.get('Content-Type')
+        if body and content_type and content_type.startswith('application/json'):
+            decoded = json.loads(body)
+        request = client.Request(self.method, None, self.query, self.request_headers, self.payload)
+        return client.Response(meta=meta, decoded=decoded, raw=body, request=request)
+
+
+class History(object):
+    """
+    The last max_entries responses, oldest first.
+
+    Once the bodies held in memory add up to more than max_bytes the oldest are compressed into a temporary directory (removed on exit), so a long session's memory stays bounded.
+    """
+    max_entries = 100
+    max_bytes = 16 * 1024 * 1024
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        if max_entries is not None:
+            self.max_entries = max_entries
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        self.entries = collections.deque()
+        self.memory_bytes = 0
+        self.count = 0
+        self.spill_dir = None
+        # responses may arrive from several threads at once (e.g. background jobs)
+        self.lock = threading.Lock()
+
+    def add(self, method, path, response, elapsed=None):
+        '''Record a client Response and the request it answered; bodies that are still being streamed aren't kept.'''
+        body = response.raw if isinstance(response.raw, basestring) else None
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        request = response.request
+        if request is not None and isinstance(request.payload, unicode):
+            request = request._replace(payload=request.payload.encode('utf-8'))
+        elif request is not None and not isinstance(request.payload, str):
+            request = request._replace(payload=json.dumps(request.payload))
+        with self.lock:
+            self.count += 1
+            entry = Entry(
+                self.count,
+                method.upper(),
+                path,
+                response.meta.status,
+                list(response.meta.headerslist),
+                body,
+                elapsed,
+                request
+            )
+            self.entries.append(entry)
+            self.memory_bytes += entry.bytes
+            while len(self.entries) > self.max_entries:
+                oldest = self.entries.popleft()
+                if not oldest.spill_path:
+                    self.memory_bytes -= oldest.bytes
+                oldest.forget()
+            for old in self.entries:
+                if self.memory_bytes <= self.max_bytes:
+                    break
+                if old.spill_path or not old.bytes:
+                    continue
+                if self.spill_dir is None:
+                    self.spill_dir = tempfile.mkdtemp(prefix='rest-cli-history-')
+                    atexit.register(shutil.rmtree, self.spill_dir, True)
+                old.spill(self.spill_dir)
+                self.memory_bytes -= old.bytes
+            return entry
+
+    def get(self, id=None):
+        '''Returns the entry with the given ID, or the latest.'''
+        with self.lock:
+            if not self.entries:
+                raise Exception('No responses yet; run a request first.')
+            if id is None:
+                return self.entries[-1]
+            for entry in self.entries:
+                if str(entry.id) == str(id):
+                    return entry
+        raise Exception('Response #%s is no longer in the history.' % id)
+
+    def __iter__(self):
+        with self.lock:
+            return iter(list(self.entries))
+
+    def __len__(self):
+        return len(self.entries)
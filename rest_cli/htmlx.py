@@ -1,4 +1,21 @@
+from collections import OrderedDict, deque
+import re
+import threading
+
+from lxml import etree
 from pyquery import PyQuery as pq
+from pyquery.cssselectpatch import JQueryTranslator
+
+
+# the same CSS => XPath translation PyQuery uses for documents it parses itself
+_translator = JQueryTranslator(xhtml=False)
+# recently parsed documents keyed by their source, least recently used first
+_documents = OrderedDict()
+max_documents = 4
+# CSS selectors compiled to XPath, kept for the life of the session
+_selectors = {}
+# both caches are shared by every thread (e.g. background jobs, fan-outs)
+_lock = threading.Lock()
 
 
 def parse_values(items):
@@ -11,20 +28,203 @@ def parse_values(items):
     return parsed
 
 
-def htmlx(data, extract=None, data_map=None, data_store=None, parsed=True):
+def parse_document(data):
+    '''Returns the parsed document for the data, reusing it if the same response was parsed recently.'''
+    with _lock:
+        doc = _documents.pop(data, None)
+        if doc is not None:
+            _documents[data] = doc
+            return doc
+    # parsed without holding the lock, so other threads needn't wait on a big document
     try:
         doc = pq(data)
     except:
         doc = pq(data.encode('ascii', 'replace'))
+    with _lock:
+        _documents.pop(data, None)
+        while len(_documents) >= max_documents:
+            _documents.popitem(last=False)
+        _documents[data] = doc
+    return doc
+
+
+def compile_selector(selector):
+    '''Returns a compiled XPath expression for a CSS selector, translating it only the first time it is seen.'''
+    with _lock:
+        compiled = _selectors.get(selector)
+    if compiled is None:
+        xpath = _translator.css_to_xpath(
+            selector.replace('[@', '['),
+            'descendant-or-self::'
+        )
+        compiled = etree.XPath(xpath)
+        with _lock:
+            compiled = _selectors.setdefault(selector, compiled)
+    return compiled
+
+
+def select(doc, selector):
+    '''Returns the elements within a parsed document matching a CSS selector.'''
+    compiled = compile_selector(selector)
+    elements = []
+    for root in doc:
+        elements.extend(compiled(root))
+    return elements
+
+
+def clear_caches():
+    with _lock:
+        _documents.clear()
+        _selectors.clear()
+
+
+def htmlx(data, extract=None, data_map=None, data_store=None, parsed=True):
+    doc = parse_document(data)
     # return ourself by default
     results = data
+    # run each distinct selector once, even if both extracted and stored
+    found = {}
+    paths = list(extract or []) + [path for (key, path) in data_map or []]
+    for path in paths:
+        if path not in found:
+            found[path] = select(doc, path)
+    convert = parse_values if parsed else pq
     if extract:
         results = []
         for path in extract:
-            items = parse_values(doc(path)) if parsed else doc(path)
-            results.append(items)
+            results.append(convert(found[path]))
+    if data_map:
+        for (key, path) in data_map:
+            data_store[key] = convert(found[path])
+    return results
+
+
+_step_re = re.compile(r'^(?P<tag>[\w-]+|\*)?(?P<quals>(?:\.[\w-]+|#[\w-]+|\[[^\]]+\])*)$')
+_qual_re = re.compile(r'\.([\w-]+)|#([\w-]+)|\[\s*([\w:-]+)\s*(?:=\s*["\']?([^"\'\]]*)["\']?\s*)?\]')
+
+
+class StreamSelector(object):
+    """
+    A CSS selector that can be checked against an element as soon as it has been parsed, using just the element and its ancestors.
+
+    Supports tag names (or '*'), '.class', '#id', '[attr]' and '[attr=value]', joined by descendant (' ') or child ('>') combinators. Tag names match regardless of XML namespace.
+    """
+
+    def __init__(self, selector):
+        self.selector = selector
+        # list of (combinator, tag, [(attr, value, is_word)]), left to right
+        self.steps = []
+        combinator = ' '
+        for token in re.findall(r'\s*>\s*|\s+|[^\s>]+', selector.strip()):
+            if not token.strip():
+                continue
+            if token.strip() == '>':
+                combinator = '>'
+                continue
+            match = _step_re.match(token)
+            if not match:
+                raise Exception('Selector "%s" is not supported when streaming; use tag names, .class, #id, [attr=value] and the " " or ">" combinators.' % selector)
+            conditions = []
+            for (cls, id, attr, value) in _qual_re.findall(match.group('quals')):
+                if cls:
+                    conditions.append(('class', cls, True))
+                elif id:
+                    conditions.append(('id', id, False))
+                else:
+                    conditions.append((attr, value or None, False))
+            self.steps.append((combinator, match.group('tag') or '*', conditions))
+            combinator = ' '
+        if not self.steps:
+            raise Exception('Empty selector.')
+
+    @staticmethod
+    def _step_matches(step, element):
+        (combinator, tag, conditions) = step
+        if tag != '*' and element.tag.rpartition('}')[2] != tag:
+            return False
+        for (attr, value, word) in conditions:
+            found = element.get(attr)
+            if found is None:
+                return False
+            if word:
+                if value not in found.split():
+                    return False
+            elif value is not None and found != value:
+                return False
+        return True
+
+    def matches(self, element):
+        """Whether the element is selected, judging by it and its ancestors."""
+        step = len(self.steps) - 1
+        return self._step_matches(self.steps[step], element) and self._link(element, step)
+
+    def _link(self, element, step):
+        # the element matched steps[step]; check how it connects to the step before it
+        if step == 0:
+            return True
+        if self.steps[step][0] == '>':
+            parent = element.getparent()
+            return parent is not None and self._step_matches(self.steps[step - 1], parent) \
+                and self._link(parent, step - 1)
+        for ancestor in element.iterancestors():
+            if self._step_matches(self.steps[step - 1], ancestor) and self._link(ancestor, step - 1):
+                return True
+        return False
+
+
+def stream_values(source, selectors, html=False):
+    """
+    Yield (selector index, value) pairs for elements matching any of the StreamSelectors, parsing the source (a file-like object) incrementally.
+
+    Each element is checked as it starts, and its value read once it has been fully parsed, after which it is cleared along with any preceding siblings, so memory stays flat no matter how large the document is. Values are the same as parse_values: an input's value, otherwise the element's text.
+
+    Matches come out in document order, as they would without streaming; those nested within another match are held back until the outer one ends.
+    """
+    # only elements with the right tag (or any, for '*') are worth checking
+    tags = set(selector.steps[-1][1] for selector in selectors)
+    # [selector index, value, done] for each match, in document order
+    queue = deque()
+    # for each element still open, the matches waiting for it to end
+    waiting = []
+    for (event, element) in etree.iterparse(source, events=('start', 'end'), html=html, huge_tree=True):
+        tag = element.tag
+        if not isinstance(tag, basestring):
+            # comments, processing instructions, etc
+            continue
+        tag = tag.rpartition('}')[2]
+        if event == 'start':
+            matches = []
+            if tag in tags or '*' in tags:
+                for (i, selector) in enumerate(selectors):
+                    if selector.matches(element):
+                        matches.append([i, None, False])
+            queue.extend(matches)
+            waiting.append(matches)
+            continue
+        for match in waiting.pop():
+            match[1] = element.get('value') if tag == 'input' else element.text
+            match[2] = True
+        while queue and queue[0][2]:
+            (i, value, done) = queue.popleft()
+            yield (i, value)
+        # anything we needed from this element has been read out
+        element.clear()
+        while element.getprevious() is not None:
+            del element.getparent()[0]
+
+
+def stream_htmlx(source, extract=None, data_map=None, data_store=None, html=False):
+    """Like htmlx, but parses the document incrementally from a file-like object. Only the selectors supported by StreamSelector can be used, and values are always parsed."""
+    paths = []
+    for path in list(extract or []) + [path for (key, path) in data_map or []]:
+        if path not in paths:
+            paths.append(path)
+    selectors = [StreamSelector(path) for path in paths]
+    found = dict((path, []) for path in paths)
+    for (i, value) in stream_values(source, selectors, html=html):
+        found[paths[i]].append(value)
+    results = [found[path] for path in extract or []]
     if data_map:
         for (key, path) in data_map:
-            extracted = parse_values(doc(path)) if parsed else doc(path)
-            data_store[key] = extracted
+            data_store[key] = found[path]
     return results
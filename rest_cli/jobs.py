@@ -0,0 +1,190 @@
+"""Run shell commands in background threads, holding on to their output so it can be printed later and in order."""
+
+import Queue
+import sys
+import threading
+import time
+
+
+_local = threading.local()
+
+
+def current_job():
+    '''Returns the job running in this thread, if any.'''
+    return getattr(_local, 'job', None)
+
+
+class OutputRouter(object):
+    """
+    Stands in for sys.stdout/sys.stderr: writes made by a job's thread are kept with that job instead of going to the terminal.
+
+    Anything else (e.g. isatty, encoding) is passed through to the real stream.
+    """
+
+    def __init__(self, stream, name):
+        self.stream = stream
+        self.name = name
+
+    def write(self, text):
+        job = current_job()
+        if job is None:
+            self.stream.write(text)
+        else:
+            job.capture(self.name, text)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        if current_job() is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def install():
+    '''Route sys.stdout and sys.stderr through OutputRouters, if not already.'''
+    if not isinstance(sys.stdout, OutputRouter):
+        sys.stdout = OutputRouter(sys.stdout, 'stdout')
+    if not isinstance(sys.stderr, OutputRouter):
+        sys.stderr = OutputRouter(sys.stderr, 'stderr')
+
+
+def uninstall():
+    '''Put back the streams the OutputRouters stand in for, if installed.'''
+    if isinstance(sys.stdout, OutputRouter):
+        sys.stdout = sys.stdout.stream
+    if isinstance(sys.stderr, OutputRouter):
+        sys.stderr = sys.stderr.stream
+
+
+def run_all(func, items, limit):
+    '''
+    Call func with each item, using up to limit threads at once. Returns a (result, exception) pair for each item, in order.
+
+    Output from the threads goes wherever this thread's output goes (e.g. into the job we're running as).
+    '''
+    items = list(items)
+    results = [None] * len(items)
+    queue = Queue.Queue()
+    for i in range(len(items)):
+        queue.put(i)
+    parent = current_job()
+
+    def work():
+        _local.job = parent
+        while True:
+            try:
+                i = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[i] = (func(items[i]), None)
+            except Exception as e:
+                results[i] = (None, e)
+
+    threads = [threading.Thread(target=work) for n in range(max(1, min(limit, len(items))))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        # joining without a timeout would block Ctrl-C
+        while thread.is_alive():
+            thread.join(0.1)
+    return results
+
+
+class Job(object):
+    """
+    A command running in its own thread, optionally after other jobs have finished (e.g. ones producing data it uses).
+
+    The command's output is captured until replayed; its return value is 'rv' (0 for success), which the command may also set while running.
+    """
+
+    def __init__(self, id, command, func, after=None, limit=None):
+        self.id = id
+        self.command = command
+        self.func = func
+        self.after = after or []
+        # a semaphore bounding how many jobs run at once
+        self.limit = limit
+        self.output = []
+        self.rv = None
+        self.result = None
+        self.killed = False
+        self.started = None
+        self.finished = None
+        self.thread = threading.Thread(target=self._run, name='job-%s' % id)
+        self.thread.daemon = True
+
+    def start(self):
+        install()
+        self.thread.start()
+        return self
+
+    def _run(self):
+        for job in self.after:
+            job.join()
+        _local.job = self
+        if self.limit:
+            self.limit.acquire()
+        self.started = time.time()
+        try:
+            self.result = self.func()
+            if self.rv is None:
+                self.rv = 0
+        except Exception as e:
+            self.rv = 1
+            self.capture('stderr', '! %s\n' % e)
+        finally:
+            self.finished = time.time()
+            if self.limit:
+                self.limit.release()
+            _local.job = None
+
+    def capture(self, name, text):
+        if not self.killed:
+            self.output.append((name, text))
+
+    def join(self, timeout=None):
+        '''Wait for the job to finish; returns whether it has.'''
+        if timeout is None:
+            # joining without a timeout would block Ctrl-C
+            while self.thread.is_alive():
+                self.thread.join(0.1)
+        else:
+            self.thread.join(timeout)
+        return not self.thread.is_alive()
+
+    def done(self):
+        return self.finished is not None
+
+    def status(self):
+        if self.killed:
+            return 'killed'
+        if self.started is None:
+            return 'waiting'
+        if self.finished is None:
+            return 'running'
+        return 'failed' if self.rv else 'done'
+
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def replay(self):
+        '''Print (and forget) the output captured so far.'''
+        streams = {'stdout': sys.stdout, 'stderr': sys.stderr}
+        (output, self.output) = (self.output, [])
+        for (name, text) in output:
+            streams[name].write(text)
+        for stream in streams.values():
+            stream.flush()
+
+    def kill(self):
+        '''Abandon the job: its output is discarded and it won't store any data. Threads can't be interrupted, so a request already in flight still runs to completion.'''
+        self.killed = True
+        self.output = []
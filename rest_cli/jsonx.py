@@ -7,6 +7,10 @@
 #   * filter (or include) results based on values (e.g. "-f 'foo/id >= 3'")
 #   * verbose debugging to troubleshoot filtering/extraction
 
+import array
+import csv
+import itertools
+import random
 import sys
 import re
 import collections
@@ -15,6 +19,10 @@ try:
 except:
     import simplejson
     json = simplejson
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 def usage():
@@ -35,6 +43,17 @@ ARGUMENTS:
    -S|--no-sort          Do not sort JSON object keys (default: false).
    -d|--debug            Display debugging information on STDERR.
    -i|--indent INDENT    Indent JSON formatted output with spaces (default: 4).
+   -c|--compact          Compact JSON output: no indentation, spaces or key sorting.
+   -t|--table COLUMNS    Print extracted records as CSV using the comma-separated column PATHs.
+   -T|--tsv              Use tabs instead of commas to separate --table columns.
+   -a|--aggregate PATH   Print count, sum, min, max, mean and percentiles of the numbers at PATH
+                         within each extracted record (use '' for the record itself), along with
+                         how many records had none there ("missing").
+   -g|--group-by PATH    Group --aggregate results by the value at PATH within each record.
+   -P|--percentiles LIST Comma-separated percentiles to compute (default: 50,90,99).
+   -n|--sample N         Return a uniform random sample of N values for each --extract PATH.
+   -l|--limit N          Stop parsing once N values have been extracted for each --extract PATH.
+                         Applied before --sample when both are given.
 
 PATHS
     The JSON data can be filtered based on index, key matches, ranges, etc. The JSON object is mapped to a directory-like structure (e.g. '/dict/dict_key', '/array/0') syntax with some extra tricks. The field separator between path parts can be changed with the -F|--fs option.
@@ -63,6 +82,13 @@ examples:
     > echo "$json" | json -p -x lols/\*
     lols_a=3
     lols_b=3
+    > echo '{"items": [{"id": 1, "size": 3}, {"id": 2, "size": 5}]}' > items.json
+    > json items.json -x items --table id,size
+    id,size
+    1,3
+    2,5
+    > json items.json -x items/* -a size -i 0
+    {"count": 2, "max": 5, "mean": 4.0, "min": 3, "missing": 0, "p50": 4.0, "p90": 4.8, "p99": 4.98, "sum": 8}
 ''')
 
 
@@ -83,6 +109,40 @@ def get_opts(defaults, argv):
             if i == len(argv):
                 raise Exception("Missing path to --exists.")
             opts['exists'].append(argv[i])
+        elif arg == '-t' or arg == '--table':
+            i += 1
+            if i == len(argv):
+                raise Exception("Missing column paths to --table.")
+            opts['table'] = argv[i].split(',')
+        elif arg == '-T' or arg == '--tsv':
+            opts['table_delimiter'] = '\t'
+        elif arg == '-a' or arg == '--aggregate':
+            i += 1
+            if i == len(argv):
+                raise Exception("Missing path to --aggregate.")
+            opts['aggregate'] = argv[i]
+        elif arg == '-g' or arg == '--group-by':
+            i += 1
+            if i == len(argv):
+                raise Exception("Missing path to --group-by.")
+            opts['group_by'] = argv[i]
+        elif arg == '-P' or arg == '--percentiles':
+            i += 1
+            if i == len(argv):
+                raise Exception("Missing list of percentiles.")
+            opts['percentiles'] = [float(pct) for pct in argv[i].split(',')]
+        elif arg == '-n' or arg == '--sample':
+            i += 1
+            if i == len(argv):
+                raise Exception("Missing number of values to --sample.")
+            opts['sample'] = int(argv[i])
+        elif arg == '-l' or arg == '--limit':
+            i += 1
+            if i == len(argv):
+                raise Exception("Missing number of values to --limit.")
+            opts['limit'] = int(argv[i])
+        elif arg == '-c' or arg == '--compact':
+            opts['compact'] = True
         elif arg == '-S' or arg == '--no-sort':
             opts['sort_keys'] = False
         elif arg == '-d' or arg == '--debug':
@@ -217,14 +277,51 @@ def print_obj(obj):
     )
 
 
-def exclude_path(obj, path, separator='/', prefix='', quiet=False, debug=False):
-    """Exclude values from an object based on a path."""
+def iter_json(obj, indent=4, sort_keys=True, compact=False):
+    """Yield an object's JSON text in pieces as it is encoded. Compact output uses no indentation, no key sorting and no spaces after separators."""
+    if compact:
+        encoder = json.JSONEncoder(ensure_ascii=True, separators=(',', ':'))
+    else:
+        encoder = json.JSONEncoder(
+            ensure_ascii=True,
+            sort_keys=sort_keys,
+            indent=indent
+        )
+    return encoder.iterencode(obj)
+
+
+def write_json(obj, stream=None, indent=4, sort_keys=True, compact=False,
+               buffer_size=65536):
+    """
+    Write an object to the stream as JSON while it is being encoded, rather than building the whole string first.
+
+    At most about buffer_size characters are held before being written out.
+    """
+    if stream is None:
+        stream = sys.stdout
+    chunks = []
+    size = 0
+    for chunk in iter_json(obj, indent, sort_keys, compact):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size >= buffer_size:
+            stream.write(''.join(chunks))
+            chunks = []
+            size = 0
+    if chunks:
+        stream.write(''.join(chunks))
+
+
+def mark_path(obj, path, marks=None, separator='/', quiet=False, debug=False):
+    """
+    Mark the locations matching a path for exclusion without modifying the object.
+
+    Marks are a tree of dicts mirroring the object: a key maps to True if the value is excluded entirely, or to another dict of marks for the locations within it. List indexes are always stored as positive offsets.
+    """
+    if marks is None:
+        marks = {}
     # break the path into parts
     path_parts = path.split(separator)
-    # keep track of the values we've collected
-    excluded = []
-    if prefix:
-        prefix = prefix + separator
     for key in parse_keys(obj, path_parts[0], quiet):
         # try to get the value
         try:
@@ -233,19 +330,79 @@ def exclude_path(obj, path, separator='/', prefix='', quiet=False, debug=False):
             if not quiet:
                 raise Exception("Invalid key '%s' not found in object '%s'." % (key, dump_obj(obj)))
             continue
-        # our current path thus far
-        subpath = prefix + str(key)
-        # at the end of our path? we've got what we want here
+        if isinstance(obj, list) and key < 0:
+            key += len(obj)
+        # at the end of our path? the whole value goes
         if len(path_parts) == 1:
-            del obj[key]
+            marks[key] = True
         else:
-            exclude_path(
+            submarks = marks.get(key)
+            if submarks is True:
+                # already excluded by another path
+                continue
+            if submarks is None:
+                submarks = marks[key] = {}
+            mark_path(
                 value,
                 separator.join(path_parts[1:]),
+                submarks,
                 separator,
-                subpath,
                 quiet
             )
+    return marks
+
+
+def prune_marks(obj, marks):
+    """Return a copy of the object without the marked locations. Unmarked subtrees are shared with the original object."""
+    if not marks:
+        return obj
+    if isinstance(obj, dict):
+        pruned = {}
+        for key, value in obj.iteritems():
+            submarks = marks.get(key)
+            if submarks is True:
+                continue
+            pruned[key] = prune_marks(value, submarks)
+        return pruned
+    if isinstance(obj, list):
+        # arrays are compacted once, after every index has been marked
+        pruned = []
+        for i, value in enumerate(obj):
+            submarks = marks.get(i)
+            if submarks is True:
+                continue
+            pruned.append(prune_marks(value, submarks))
+        return pruned
+    return obj
+
+
+def exclude_paths(obj, paths, separator='/', quiet=False, debug=False):
+    """Return a copy of the object with the values matching any of the paths removed. The original object is left intact."""
+    marks = {}
+    for path in paths:
+        mark_path(
+            obj,
+            path.strip(separator),
+            marks,
+            separator=separator,
+            quiet=quiet,
+            debug=debug
+        )
+    return prune_marks(obj, marks)
+
+
+def exclude_path(obj, path, separator='/', prefix='', quiet=False, debug=False):
+    """Exclude values from an object based on a path, modifying the object in place."""
+    marks = mark_path(obj, path, separator=separator, quiet=quiet, debug=debug)
+
+    def remove(obj, marks):
+        # delete from the end so list indexes stay valid as we go
+        for key in sorted(marks, reverse=True):
+            if marks[key] is True:
+                del obj[key]
+            else:
+                remove(obj[key], marks[key])
+    remove(obj, marks)
 
 
 def extract_path(obj, path, separator='/', prefix='', quiet=False, debug=False):
@@ -283,13 +440,403 @@ def extract_path(obj, path, separator='/', prefix='', quiet=False, debug=False):
     return extracted
 
 
+_whitespace_re = re.compile(r'[ \t\n\r]*')
+
+
+def stream_range(path):
+    """Return the (start, stop) indexes an array path part selects if it can be resolved without knowing the array's length; None otherwise."""
+    if path == '*':
+        path = ':'
+    try:
+        if path.find(':') == -1:
+            index = int(path)
+            if index < 0:
+                return None
+            return (index, index + 1)
+        parts = path.strip().split(':')
+        if len(parts) != 2:
+            return None
+        start = int(parts[0]) if parts[0] else 0
+        stop = int(parts[1]) + 1 if parts[1] else None
+    except ValueError:
+        return None
+    if start < 0 or (stop is not None and stop <= 0):
+        return None
+    return (start, stop)
+
+
+class JSONStream(object):
+    """
+    Extracts values from JSON text while scanning it, decoding only the values that match a path.
+
+    Values outside of the path are skipped over as they are reached, so matches are produced one at a time and scanning stops as soon as the caller stops asking for more. Array ranges that need the array's length (e.g. '-2:') fall back to decoding that array.
+    """
+
+    def __init__(self, text, separator='/'):
+        self.text = text
+        self.separator = separator
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def extract(self, path):
+        """Yield (path, key, value) tuples for each match, like extract_path."""
+        self.pos = 0
+        path = path.strip(self.separator)
+        parts = path.split(self.separator) if path else []
+        return self._walk(parts, '', None)
+
+    def _ws(self):
+        self.pos = _whitespace_re.match(self.text, self.pos).end()
+
+    def _value(self):
+        (value, self.pos) = self.decoder.raw_decode(self.text, self.pos)
+        return value
+
+    def _expect(self, chars):
+        self._ws()
+        char = self.text[self.pos:self.pos + 1]
+        if not char or char not in chars:
+            raise ValueError("Expecting one of '%s' at char %d." % (chars, self.pos))
+        self.pos += 1
+        return char
+
+    def _subpath(self, prefix, key):
+        if prefix:
+            return prefix + self.separator + unicode(key)
+        return unicode(key)
+
+    def _walk(self, parts, prefix, key):
+        self._ws()
+        if not parts:
+            yield (prefix, key, self._value())
+            return
+        char = self.text[self.pos:self.pos + 1]
+        if char == '{':
+            walker = self._walk_object
+        elif char == '[':
+            walker = self._walk_array
+        else:
+            # nothing to descend into
+            self._value()
+            return
+        for match in walker(parts, prefix):
+            yield match
+
+    def _walk_object(self, parts, prefix):
+        try:
+            key_re = re.compile(parts[0])
+        except Exception as e:
+            raise Exception('Unable to compile path part "%s" to regex: %s' % (parts[0], e))
+        self._expect('{')
+        self._ws()
+        if self.text[self.pos:self.pos + 1] == '}':
+            self.pos += 1
+            return
+        while True:
+            self._ws()
+            key = self._value()
+            self._expect(':')
+            if re.match(key_re, key):
+                for match in self._walk(parts[1:], self._subpath(prefix, key), key):
+                    yield match
+            else:
+                self._ws()
+                self._value()
+            if self._expect(',}') == '}':
+                return
+
+    def _walk_array(self, parts, prefix):
+        selected = stream_range(parts[0])
+        if selected is None:
+            # we need the whole array to resolve this one
+            matches = extract_path(
+                self._value(),
+                self.separator.join(parts),
+                separator=self.separator,
+                prefix=prefix,
+                quiet=True
+            )
+            for match in matches:
+                yield match
+            return
+        (start, stop) = selected
+        self._expect('[')
+        self._ws()
+        if self.text[self.pos:self.pos + 1] == ']':
+            self.pos += 1
+            return
+        index = 0
+        while True:
+            if index >= start and (stop is None or index < stop):
+                for match in self._walk(parts[1:], self._subpath(prefix, index), index):
+                    yield match
+            else:
+                self._ws()
+                self._value()
+            index += 1
+            if self._expect(',]') == ']':
+                return
+
+
+def reservoir_sample(items, size, rand=random):
+    """Return a uniform random sample of up to size items from an iterable of unknown length in a single pass."""
+    sample = []
+    for (i, item) in enumerate(items):
+        if i < size:
+            sample.append(item)
+        else:
+            j = rand.randint(0, i)
+            if j < size:
+                sample[j] = item
+    return sample
+
+
+def first_value(obj, path, separator='/', default=None):
+    """Return the first value matching a path within an object, or the object itself if the path is blank."""
+    path = path.strip(separator)
+    if not path:
+        return obj
+    try:
+        found = extract_path(obj, path, separator=separator, quiet=True)
+    except:
+        return default
+    if not found:
+        return default
+    return found[0][2]
+
+
+def iter_records(values):
+    """Yield records from extracted values; extracted arrays contribute each of their items."""
+    for value in values:
+        if isinstance(value, list):
+            for item in value:
+                yield item
+        else:
+            yield value
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=True, sort_keys=True)
+
+
+def format_table(records, columns, separator='/', delimiter=',', header=True):
+    """Yield CSV/TSV lines for the records, one column per path."""
+    lines = []
+
+    class LineBuffer(object):
+        write = lines.append
+
+    writer = csv.writer(LineBuffer(), delimiter=delimiter, lineterminator='')
+    if header:
+        writer.writerow(columns)
+        yield lines.pop()
+    for record in records:
+        writer.writerow([
+            _cell(first_value(record, column, separator))
+            for column in columns
+        ])
+        yield lines.pop()
+
+
+def percentile(values, pct):
+    """Linearly interpolated percentile of sorted values."""
+    if not len(values):
+        return None
+    rank = (len(values) - 1) * pct / 100.0
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+class Aggregate(object):
+    """Running statistics over a stream of values; numeric values are packed into a double array for percentiles. Values that are missing or not numbers are counted separately, as "missing"."""
+
+    def __init__(self):
+        self.count = 0
+        self.missing = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+        self.values = array.array('d')
+
+    def add(self, value):
+        if isinstance(value, bool) or not isinstance(value, (int, long, float)):
+            self.missing += 1
+            return
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        self.values.append(value)
+
+    def results(self, percentiles=(50, 90, 99)):
+        stats = {
+            'count': self.count,
+            'missing': self.missing,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'mean': None
+        }
+        if self.count:
+            stats['mean'] = float(self.sum) / self.count
+        if numpy is not None and len(self.values):
+            values = numpy.frombuffer(self.values, dtype=numpy.float64)
+            found = numpy.percentile(values, list(percentiles))
+            for (pct, value) in zip(percentiles, found):
+                stats['p%g' % pct] = float(value)
+        else:
+            values = sorted(self.values)
+            for pct in percentiles:
+                stats['p%g' % pct] = percentile(values, pct)
+        return stats
+
+
+def aggregate_records(records, path='', group_by=None, separator='/', percentiles=(50, 90, 99)):
+    """Compute count, sum, min, max, mean and percentiles of the numeric value at path within each record (and how many records had none) in a single pass, optionally grouped by the value at another path."""
+    groups = collections.OrderedDict()
+    for record in records:
+        if group_by is None:
+            group = None
+        else:
+            group = first_value(record, group_by, separator)
+            if not isinstance(group, basestring):
+                group = json.dumps(group, ensure_ascii=True, sort_keys=True)
+        if group not in groups:
+            groups[group] = Aggregate()
+        groups[group].add(first_value(record, path, separator))
+    if group_by is None:
+        return (groups[None] if groups else Aggregate()).results(percentiles)
+    return dict(
+        (group, stats.results(percentiles))
+        for (group, stats) in groups.iteritems()
+    )
+
+
+def diff(old, new, path='', separator='/'):
+    """
+    Yield the differences between two decoded JSON objects as (op, path, old value, new value), where op is '+' (added), '-' (removed) or '~' (changed).
+
+    Identical subtrees are skipped with a single comparison, so objects that have barely changed are cheap to diff no matter how large they are.
+    """
+    if old == new:
+        return
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in sorted(set(old) | set(new)):
+            sub_path = path + separator + unicode(key) if path else unicode(key)
+            if key not in new:
+                yield ('-', sub_path, old[key], None)
+            elif key not in old:
+                yield ('+', sub_path, None, new[key])
+            else:
+                for change in diff(old[key], new[key], sub_path, separator):
+                    yield change
+    elif isinstance(old, list) and isinstance(new, list):
+        for i in range(max(len(old), len(new))):
+            sub_path = path + separator + str(i) if path else str(i)
+            if i >= len(new):
+                yield ('-', sub_path, old[i], None)
+            elif i >= len(old):
+                yield ('+', sub_path, None, new[i])
+            else:
+                for change in diff(old[i], new[i], sub_path, separator):
+                    yield change
+    else:
+        yield ('~', path, old, new)
+
+
 def jsonx(data, indent=4, pairs=False, sort_keys=True, debug=False,
           quiet=False, separator='/', extract=None, exclude=None, exists=None,
-          raw=False, data_map=None, data_store=None):
+          raw=False, data_map=None, data_store=None, table=None,
+          table_delimiter=',', aggregate=None, group_by=None,
+          percentiles=(50, 90, 99), sample=None, limit=None, compact=False,
+          output=None):
+    """
+    Filter JSON data and return the results as a list of JSON strings (or the values themselves if raw).
+
+    If an output stream is given the results are instead written to it as they are encoded, one per line, and an empty list is returned.
+    """
+    stream = None
+    obj = data
     if isinstance(data, basestring):
-        obj = json.JSONDecoder().decode(data)
-    else:
-        obj = data
+        if extract and (sample or limit) and not (exists or data_map or exclude):
+            # no need to decode everything when we're just picking values out
+            stream = JSONStream(data, separator=separator)
+        else:
+            obj = json.JSONDecoder().decode(data)
+    if compact:
+        (indent, sort_keys) = (None, False)
+    results = []
+
+    def streamed(path):
+        matched = False
+        for match in stream.extract(path):
+            matched = True
+            yield match
+        if not matched and not quiet:
+            # decode it all after all, to fail just as we would have without streaming
+            for match in extract_path(
+                json.JSONDecoder().decode(data),
+                path,
+                separator=separator,
+                quiet=quiet,
+                debug=debug
+            ):
+                yield match
+
+    def matches(path):
+        if stream is not None:
+            found = streamed(path.strip('/'))
+        else:
+            found = extract_path(
+                obj,
+                path.strip('/'),
+                separator=separator,
+                quiet=quiet,
+                debug=debug
+            )
+        if limit:
+            found = itertools.islice(found, limit)
+        if sample:
+            found = reservoir_sample(found, sample)
+        return found
+
+    def emit(value, prefix=''):
+        if raw and not prefix:
+            results.append(value)
+        elif output is not None:
+            output.write(prefix)
+            write_json(
+                value,
+                output,
+                indent=indent,
+                sort_keys=sort_keys,
+                compact=compact
+            )
+            output.write('\n')
+        else:
+            results.append(prefix + json.dumps(
+                value,
+                ensure_ascii=True,
+                sort_keys=sort_keys,
+                indent=indent,
+                separators=(',', ':') if compact else None
+            ))
+
+    def emit_line(line):
+        if output is not None:
+            output.write(line + '\n')
+        else:
+            results.append(line)
+
     if exists:
         for path in exists:
             try:
@@ -307,60 +854,60 @@ def jsonx(data, indent=4, pairs=False, sort_keys=True, debug=False,
     # a simple way to allow callers to maintain a memory of interesting values
     if data_map and data_store is not None:
         for (key, path) in data_map:
-            data_store[key] = extract_path(
+            data_store[key] = [value for (subpath, subkey, value) in extract_path(
                 obj,
                 path.strip('/'),
-                path.strip('/'),
                 separator=separator,
                 quiet=True,
                 debug=debug
-            )
-    # trim out any requested data
+            )]
+    # trim out any requested data; the caller's object is left untouched
     if exclude:
-        for path in exclude:
-            exclude_path(
-                obj,
-                path.strip('/'),
-                separator=separator,
-                quiet=quiet,
-                debug=debug
+        obj = exclude_paths(
+            obj,
+            exclude,
+            separator=separator,
+            quiet=quiet,
+            debug=debug
+        )
+    if table or aggregate is not None:
+        # records come from the extracted values, or the whole document
+        if extract:
+            values = (
+                value
+                for path in extract
+                for (subpath, key, value) in matches(path)
             )
-    # we'll print back the obj by default
-    results = [obj if raw else json.dumps(
-        obj,
-        ensure_ascii=True,
-        sort_keys=sort_keys,
-        indent=indent
-    )]
-    if extract:
-        results = []
+        else:
+            values = [obj]
+        records = iter_records(values)
+        if table:
+            for line in format_table(
+                records,
+                table,
+                separator=separator,
+                delimiter=table_delimiter
+            ):
+                emit_line(line)
+        else:
+            emit(aggregate_records(
+                records,
+                aggregate,
+                group_by=group_by,
+                separator=separator,
+                percentiles=percentiles
+            ))
+    elif extract:
         name_re = re.compile(r'\W+')
         for path in extract:
-            data = extract_path(
-                obj,
-                path.strip('/'),
-                separator=separator,
-                quiet=quiet,
-                debug=debug
-            )
-            for (path, key, value) in data:
+            for (path, key, value) in matches(path):
                 if pairs:
-                    results.append("%s=%s" % (
-                        re.sub(name_re, '_', path),
-                        json.dumps(
-                            value,
-                            ensure_ascii=True,
-                            sort_keys=sort_keys,
-                            indent=indent
-                        )
-                    ))
+                    emit(value, "%s=" % re.sub(name_re, '_', path))
                 else:
-                    results.append(value if raw else json.dumps(
-                        value,
-                        ensure_ascii=True,
-                        sort_keys=sort_keys,
-                        indent=indent
-                    ))
+                    emit(value)
+    else:
+        # we'll print back the obj by default
+        emit(obj)
     return results
 
 # stand-alone script mode
@@ -378,7 +925,15 @@ if __name__ == '__main__':
             'json_file': None,
             'extract': [],
             'exclude': [],
-            'exists': []
+            'exists': [],
+            'table': None,
+            'table_delimiter': ',',
+            'aggregate': None,
+            'group_by': None,
+            'percentiles': (50, 90, 99),
+            'sample': None,
+            'limit': None,
+            'compact': False
         }, sys.argv)
 
         # we got something, right?
@@ -395,9 +950,7 @@ if __name__ == '__main__':
         # we'll pass the JSON explicitly
         del opts['json']
         del opts['json_file']
-        results = jsonx(json_data, **opts)
-        for result in results:
-            print result
+        jsonx(json_data, output=sys.stdout, **opts)
     except Exception as e:
         sys.stderr.write(e.message + "\n")
         retval = 1
@@ -0,0 +1,79 @@
+"""Profile commands, breaking down where the time went by phase (parsing, the request, decoding, extraction, rendering) as well as by function."""
+
+from collections import OrderedDict
+import cProfile
+import pstats
+import sys
+import threading
+import time
+
+
+_local = threading.local()
+
+
+def current():
+    '''Returns the Timings being recorded in this thread, if any.'''
+    return getattr(_local, 'timings', None)
+
+
+class Timings(object):
+    """Wall-clock time spent in each phase of a command, in the order the phases were first entered."""
+
+    def __init__(self):
+        self.phases = OrderedDict()
+
+    def add(self, name, elapsed):
+        self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+
+def add(name, elapsed):
+    '''Count elapsed seconds towards a phase, if this thread is being profiled.'''
+    timings = current()
+    if timings is not None:
+        timings.add(name, elapsed)
+
+
+def timed(name, func, *args, **kwargs):
+    '''
+    Call func, counting the time it takes towards a phase (e.g. "decode") if this thread is being profiled.
+
+    Streamed bodies are read as they're used, so their network time is counted towards whatever reads them (e.g. "extract").
+    '''
+    if current() is None:
+        return func(*args, **kwargs)
+    started = time.time()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        add(name, time.time() - started)
+
+
+def profile(func, dump=None, top=20):
+    '''Call func under cProfile and print where the time went to stderr, optionally dumping the stats to a file (e.g. for "python -m pstats FILE"). Returns func's result.'''
+    timings = _local.timings = Timings()
+    profiler = cProfile.Profile()
+    started = time.time()
+    try:
+        return profiler.runcall(func)
+    finally:
+        total = time.time() - started
+        _local.timings = None
+        report(timings, total, profiler, top)
+        if dump:
+            try:
+                profiler.dump_stats(dump)
+            except IOError as e:
+                sys.stderr.write('! Failed to write profile: %s\n' % e)
+
+
+def report(timings, total, profiler, top=20):
+    '''Print the time spent in each phase, then the functions taking the most time themselves.'''
+    stream = sys.stderr
+    stream.write('# Profile: %.3fs total (including profiling overhead)\n' % total)
+    other = total
+    for (name, elapsed) in timings.phases.items():
+        other -= elapsed
+        stream.write('#   %-10s %8.3fs %5.1f%%\n' % (name, elapsed, 100.0 * elapsed / total if total else 0))
+    stream.write('#   %-10s %8.3fs %5.1f%%\n' % ('other', max(other, 0), 100.0 * max(other, 0) / total if total else 0))
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.strip_dirs().sort_stats('tottime').print_stats(top)
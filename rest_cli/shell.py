@@ -2,20 +2,22 @@
 
 """Shell for interacting with a RESTful server."""
 
-# TODO:
-# - save last response for replay (e.g. full formatting)
-# - piping for less/etc
-
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from traceback import print_exception
 from urllib import quote
+import atexit
+import errno
 import os
 import os.path
+import functools
 import re
 import shlex  # simple lexical anaysis for command line parsing
+import signal
 import socket
 import subprocess  # for shell commands
 import sys
+import threading
+import time
 
 # import hacks!
 os.environ['TERM'] = 'linux'
@@ -28,10 +30,19 @@ except:
 
 from restkit.errors import RequestError
 
-from jsonx import jsonx
-from htmlx import htmlx
+from formatter import OutputFormatter, formatters, lines_from_chunks
+from jsonx import jsonx, iter_json, write_json, extract_path, diff
+from htmlx import htmlx, stream_htmlx
+import cassette
 import client
+import completion
 import dbg
+import fixtures
+import har
+import history
+import jobs
+import profiling
+import store
 import util
 
 
@@ -73,16 +84,45 @@ class Shell(object):
         'config': {},
         'help': {},
         'quit': {},
-        'sh': {}
+        'sh': {},
+        'ls': {},
+        'cat': {},
+        'tree': {},
+        'jobs': {},
+        'wait': {},
+        'fg': {},
+        'kill': {},
+        'watch': {},
+        'history': {},
+        'show': {},
+        'stats': {},
+        'replay-har': {},
+        'serve-fixtures': {}
     }
+    # commands taking another command as arguments, which are left for them to parse
+    raw_cmds = ('watch', 'replay-har', 'serve-fixtures')
+    # options offered by tab completion
+    long_options = (
+        '--aggregate', '--basic', '--color', '--compact', '--data', '--exclude', '--extract',
+        '--form', '--group-by', '--har', '--header', '--help', '--invert', '--json', '--limit',
+        '--max-depth', '--max-items', '--max-string', '--no-color', '--oauth', '--parallel',
+        '--playback', '--profile', '--profile-dump', '--query', '--raw', '--record', '--sample',
+        '--script', '--shell', '--stats-file', '--store', '--stream', '--table', '--tsv', '--url',
+        '--verbose'
+    )
     _env = {
         'cwd': '/',  # where in the URL we are operating
         'last_cwd': '/',
         'histfile': None,
+        'completion_dir': None,  # where indexes of the API paths seen are cached
         'vars': {}  # automatically added to each API call
     }
     decode = json.JSONDecoder().decode
     encode = json.JSONEncoder().encode
+    # most requests to run at once when running commands in parallel
+    max_jobs = 8
+    # bytes to read from the connection at a time when piping a body into a command
+    pipe_chunk_size = 65536
 
     def __init__(self, argv):
         self.last_rv = False
@@ -90,23 +130,68 @@ class Shell(object):
             'histfile',
             os.path.join(os.path.expanduser('~'), '.rest-cli_history')
         )
+        self.env(
+            'completion_dir',
+            os.path.join(os.path.expanduser('~'), '.rest-cli_completion')
+        )
         self.main_args = {
             'color': sys.stdout.isatty(),
             'help': False,
             'formatted': True,
+            'compact': False,
+            'max_depth': None,
+            'max_items': None,
+            'max_string': None,
+            'parallel': self.max_jobs,
             'headers': {},
             'verbose': False,
             'url': 'https://localhost:443/',
-            'shell': False
+            'shell': False,
+            'script': None,
+            'store': None,
+            'profile': False,
+            'profile_dump': None,
+            'stats_file': None,
+            'har': None,
+            'record': None,
+            'playback': None
         }
-        self.data_store = {}
+        self.data_store = store.DataStore()
+        # the last full response received, kept so it can be filtered again without re-fetching
+        self.last_response = None
+        # recent responses, for replaying with 'show'
+        self.history = history.History()
+        # background jobs by ID, and the IDs we've already said are finished
+        self.jobs = OrderedDict()
+        self.job_count = 0
+        self.job_slots = threading.BoundedSemaphore(self.max_jobs)
+        self.reported_jobs = set()
+        # API paths seen, by base URL, and the completions last offered
+        self.path_indexes = {}
+        self.completions = []
+        self.refreshes = []
+        self.har_registered = False
         # parse out our initial args
         self.args = self.parse_args(argv, self.main_args)
+        if self.args['store']:
+            self.data_store = store.DataStore(self.args['store'])
         self.client = client.RESTClient(self.args['url'])
+        atexit.register(self.write_stats)
+        if self.args['record'] and self.args['playback']:
+            raise Exception('Use either --record or --playback, not both.')
+        if self.args['record']:
+            self.use_cassette('record', self.args['record'])
+        elif self.args['playback']:
+            self.use_cassette('playback', self.args['playback'])
+        if self.args['har']:
+            self.record_har(self.args['har'])
         if self.args['help']:
             return
-        # run our initial command, possibly invoking shell mode after
-        self.parse_cmd(argv)
+        # run our initial command or script, possibly invoking shell mode after
+        if self.args['script']:
+            self.run_script(self.args['script'])
+        else:
+            self.parse_cmd(argv)
         if self.args['shell']:
             self.start()
 
@@ -117,11 +202,18 @@ class Shell(object):
                 readline.read_history_file(self.env('histfile'))
             except:
                 pass
+            readline.set_completer(self.complete)
+            # paths and "foo+=" are completed as whole words
+            readline.set_completer_delims(' \t\n|>')
+            if 'libedit' in (readline.__doc__ or ''):
+                readline.parse_and_bind('bind ^I rl_complete')
+            else:
+                readline.parse_and_bind('tab: complete')
         # run APIs until the cows come home
         try:
             repeat = False
-            while self.parse_cmd(raw_input(self.get_prompt())):
-                pass
+            while self.parse_cmd(self.read_line(self.get_prompt())):
+                self.report_jobs()
         except KeyboardInterrupt as e:
             pass
         except EOFError as e:
@@ -139,9 +231,396 @@ class Shell(object):
             self.stop()
             return self.last_rv
 
+    def read_line(self, prompt):
+        '''
+        Returns a line read with raw_input, which only uses readline (for editing, history and completion) if sys.stdout is a real file.
+
+        So while background jobs have their output routed (see jobs.install), the real streams are put back just until readline starts on the line; routing resumes from its startup hook, so jobs finishing while we wait for input are still kept quiet.
+        '''
+        if not isinstance(sys.stdout, jobs.OutputRouter) or not sys.stdin.isatty():
+            return raw_input(prompt)
+        jobs.uninstall()
+        readline.set_startup_hook(jobs.install)
+        try:
+            return raw_input(prompt)
+        finally:
+            readline.set_startup_hook(None)
+            jobs.install()
+
     def stop(self):
         # save our history
         readline.write_history_file(self.env('histfile'))
+        # give any paths still being looked up a moment to arrive, rather than dying mid-request as we exit
+        for thread in self.refreshes:
+            thread.join(1)
+
+    def path_index(self):
+        '''Returns the index of API paths seen for the current base URL, loading it from the cache the first time.'''
+        url = completion.base_url(self.client.url)
+        if url not in self.path_indexes:
+            index = completion.PathIndex(url, completion.cache_file(self.env('completion_dir'), url))
+            atexit.register(index.save)
+            self.path_indexes[url] = index
+        return self.path_indexes[url]
+
+    def refresh_paths(self, directory):
+        '''Ask the server about a directory (via OPTIONS) in the background, so what it reveals can be completed next time without waiting on the network now.'''
+        index = self.path_index()
+        if not index.needs_refresh(directory):
+            return
+        if self.client.cassette is not None and self.client.cassette.playback:
+            # playback never touches the network
+            return
+        # kept out of stats, HAR files and cassettes, which are for what the user ran
+        lookup = self.client.untracked()
+
+        def refresh():
+            try:
+                answer = lookup.request(
+                    method='options',
+                    path=directory,
+                    headers=dict(self.args['headers']),
+                    full=True
+                )
+            except Exception:
+                return
+            index.learn(directory, answer.decoded, answer.meta.headers)
+
+        thread = threading.Thread(target=refresh, name='refresh-paths')
+        thread.daemon = True
+        thread.start()
+        self.refreshes = [old for old in self.refreshes if old.is_alive()] + [thread]
+
+    def complete(self, text, state):
+        '''Readline completer: returns the completion of text numbered state, or None once there are no more.'''
+        if state == 0:
+            try:
+                before = readline.get_line_buffer()[:readline.get_begidx()]
+                self.completions = self.completion_candidates(before, text)
+            except Exception:
+                # readline would swallow it anyway; just offer nothing
+                self.completions = []
+        if state < len(self.completions):
+            return self.completions[state]
+        return None
+
+    def completion_candidates(self, before, text):
+        '''Returns the possible completions of the word being typed (text), given the line before it.'''
+        try:
+            words = shlex.split(before)
+        except ValueError:
+            # e.g. within an unfinished quote
+            words = before.split()
+        if not words:
+            names = set(self.http_methods) | set(self.cmds) | set(['data', 'env'])
+        elif '|' in words or '>' in words or '>>' in words:
+            names = []
+        elif text.startswith('-'):
+            names = self.long_options
+        else:
+            verb = self.method_aliases.get(words[0].lower(), words[0].lower())
+            if verb in ('data', 'env'):
+                # e.g. "data foo", "env +=foo"
+                prefix = re.match(r'^([+-]=)?', text).group(0)
+                names = [prefix + name for name in self.data_store]
+            elif verb in self.http_methods + ('cd',) and len(words) == 1:
+                names = self.complete_path(text)
+            elif verb in self.http_methods:
+                names = [name + '+=' for name in self.data_store]
+            else:
+                names = []
+        return sorted(name for name in names if name.startswith(text))
+
+    def complete_path(self, text):
+        '''Returns the API paths seen (or "{NAME}" variable references) that could follow text.'''
+        if re.search(r'\{\w*$', text):
+            start = text[:text.rindex('{')]
+            return [start + '{%s}' % name for name in self.data_store]
+        (directory, slash, name) = text.rpartition('/')
+        directory += slash
+        path = self.parse_path(directory) if directory else self.env('cwd')
+        self.refresh_paths(path)
+        return [
+            directory + child + ('/' if more else '')
+            for (child, more) in self.path_index().children(path)
+        ]
+
+    def write_stats(self):
+        '''Write the request stats to the stats file in the Prometheus text format, if there is one.'''
+        if not self.args['stats_file'] or not self.client.stats.endpoints:
+            return
+        try:
+            self.client.stats.write_prometheus(self.args['stats_file'])
+        except (IOError, OSError) as e:
+            sys.stderr.write('! Failed to write stats: %s\n' % e)
+
+    def record_har(self, path):
+        '''Start recording requests to a HAR file, written on exit (or when recording stops or moves elsewhere).'''
+        if self.client.har is not None:
+            self.save_har()
+        self.args['har'] = path
+        self.client.har = har.Recorder(path) if path else None
+        if path and not self.har_registered:
+            atexit.register(self.save_har)
+            self.har_registered = True
+
+    def use_cassette(self, mode, directory):
+        '''Start recording responses to ("record") or playing them back from ("playback") a cassette directory, in place of any other; no directory stops that mode.'''
+        if not directory:
+            if self.args[mode]:
+                self.client.cassette = None
+                self.args[mode] = None
+            return
+        self.client.cassette = cassette.Cassette(directory, playback=(mode == 'playback'))
+        self.args['record'] = self.args['playback'] = None
+        self.args[mode] = directory
+
+    def save_har(self):
+        if self.client.har is None or not self.client.har.entries:
+            return
+        try:
+            self.client.har.save()
+        except IOError as e:
+            sys.stderr.write('! Failed to write HAR file: %s\n' % e)
+
+    def replay_har(self, params):
+        '''Replay the requests in a HAR file (e.g. "replay-har session.har --speed 10x -c 50"), then compare their latencies with the recording's.'''
+        path = None
+        speed = 1.0
+        concurrency = 10
+        origin = None
+        i = 0
+        while i < len(params):
+            if params[i] in ('--speed', '-c', '--concurrency', '-u', '--url'):
+                if i + 1 == len(params):
+                    raise Exception('Missing value for %s.' % params[i])
+                value = params[i + 1]
+                if params[i] == '--speed':
+                    speed = float(value.rstrip('xX'))
+                    if speed <= 0:
+                        raise Exception('Invalid speed: %s' % value)
+                elif params[i] in ('-c', '--concurrency'):
+                    concurrency = max(1, int(value))
+                else:
+                    origin = value
+                i += 2
+            elif params[i].startswith('-') or path is not None:
+                raise Exception('Usage: replay-har FILE [--speed FACTOR] [-c CONCURRENCY] [-u URL]')
+            else:
+                path = params[i]
+                i += 1
+        if path is None:
+            raise Exception('Usage: replay-har FILE [--speed FACTOR] [-c CONCURRENCY] [-u URL]')
+        replay = har.Replay(har.load(path), speed, concurrency, origin)
+        replay.report(replay.run())
+
+    def serve_fixtures(self, params):
+        '''Serve canned payloads from a directory until interrupted (e.g. "serve-fixtures fixtures/ --latency 5ms --size 10MB"), for benchmarking against.'''
+        usage = 'Usage: serve-fixtures DIR [--port N] [--host HOST] [--latency DURATION] [--size SIZE] [--status CODE] ' \
+            '[--chunked SIZE] [--gzip] [--per-page N] [-v]'
+        directory = None
+        (host, port) = ('127.0.0.1', 8000)
+        options = {}
+        i = 0
+        while i < len(params):
+            param = params[i]
+            if param in ('--gzip', '-v', '--verbose'):
+                options['compress' if param == '--gzip' else 'verbose'] = True
+                i += 1
+                continue
+            if not param.startswith('-'):
+                if directory is not None:
+                    raise Exception(usage)
+                directory = param
+                i += 1
+                continue
+            if i + 1 == len(params):
+                raise Exception('Missing value for %s.' % param)
+            value = params[i + 1]
+            if param == '--port':
+                port = int(value)
+            elif param == '--host':
+                host = value
+            elif param == '--latency':
+                options['latency'] = util.parse_duration(value)
+            elif param == '--size':
+                options['size'] = util.parse_size(value)
+            elif param == '--status':
+                options['status'] = int(value)
+            elif param == '--chunked':
+                options['chunk_size'] = util.parse_size(value)
+            elif param == '--per-page':
+                options['per_page'] = int(value)
+            else:
+                raise Exception(usage)
+            i += 2
+        if directory is None:
+            raise Exception(usage)
+        fixtures.serve(directory, host, port, **options)
+
+    def set_rv(self, rv):
+        '''Record the result of a command (0 for success); commands running as jobs record it on the job instead.'''
+        job = jobs.current_job()
+        if job is None:
+            self.last_rv = rv
+        else:
+            job.rv = rv
+
+    def background(self, cmd):
+        '''Run a command as a background job, returning to the prompt right away.'''
+        if not cmd:
+            raise Exception('Missing command to run in the background.')
+        self.job_count += 1
+        job = jobs.Job(self.job_count, cmd, functools.partial(self.parse_cmd, cmd), limit=self.job_slots)
+        self.jobs[job.id] = job
+        job.start()
+        sys.stderr.write('[%d] %s\n' % (job.id, cmd))
+        return True
+
+    def get_job(self, id):
+        try:
+            return self.jobs[int(id)]
+        except (KeyError, ValueError):
+            raise Exception('No such job: %s' % id)
+
+    def report_jobs(self):
+        '''Note any background jobs that have finished since we last checked; those with nothing to show are forgotten.'''
+        for job in self.jobs.values():
+            if not job.done() or job.id in self.reported_jobs:
+                continue
+            self.reported_jobs.add(job.id)
+            if job.output:
+                sys.stderr.write("[%d] %s (%.2fs)  %s  -- 'fg %d' for output\n" % (
+                    job.id, job.status(), job.elapsed(), job.command, job.id
+                ))
+            else:
+                sys.stderr.write('[%d] %s (%.2fs)  %s\n' % (
+                    job.id, job.status(), job.elapsed(), job.command
+                ))
+                del self.jobs[job.id]
+
+    def wait_jobs(self, ids):
+        '''Wait for background jobs to finish, printing their output in turn.'''
+        for job in [self.get_job(id) for id in ids]:
+            try:
+                job.join()
+            except KeyboardInterrupt:
+                sys.stderr.write('\n! Stopped waiting; job %d is still running.\n' % job.id)
+                return
+            job.replay()
+            self.reported_jobs.add(job.id)
+            del self.jobs[job.id]
+
+    def script_deps(self, line):
+        '''
+        Work out what a script line relies on without running it. Returns (parallel, needs, produces): whether the line is a request that may run alongside others, the names of stored data it uses (e.g. "foo+=") and the names it stores (e.g. "-d foo=items/0").
+
+        Files the output is redirected to count as both used and stored, so writes to the same file stay in order. Lines piping into shell commands aren't run in parallel, as the commands' output can't be held back.
+        '''
+        segments = self.split_pipeline(line)
+        parts = self.expand_flags(shlex.split(segments[0]))
+        needs = set()
+        produces = set()
+        verb = parts[0].lower() if parts else None
+        parallel = self.method_aliases.get(verb, verb) in ('get', 'options')
+        for segment in segments[1:]:
+            if self.formatter_stage(segment) is None:
+                # piped into a shell command, which writes straight to the terminal
+                parallel = False
+        i = 0
+        while i < len(parts):
+            part = parts[i]
+            if part in ('-d', '--data') and i + 1 < len(parts):
+                i += 1
+                name = parts[i].split('=', 1)[0]
+                if name.endswith('+'):
+                    # it'll be added to the env, and so to every request after
+                    parallel = False
+                produces.add(name.rstrip('+'))
+            elif part.startswith('>'):
+                target = part.lstrip('>')
+                if not target and i + 1 < len(parts):
+                    i += 1
+                    target = parts[i]
+                needs.add('>' + os.path.abspath(target))
+                produces.add('>' + os.path.abspath(target))
+            else:
+                match = re.match(r'^([^=]+)\+=', part)
+                if match:
+                    needs.add(match.group(1))
+                # e.g. "users/{ids}/profile"
+                needs.update(re.findall(r'\{(\w+)\}', part))
+            i += 1
+        return (parallel, needs, produces)
+
+    def run_script(self, path):
+        '''
+        Run the shell commands within a file, one per line (blank lines and those starting with '#' are skipped).
+
+        GET/OPTIONS requests run in parallel, each waiting only for earlier lines storing data it uses; anything else (e.g. POST, cd, set) waits for everything before it to finish and runs on its own. Output is printed in script order.
+        '''
+        try:
+            with open(path) as script:
+                lines = script.read().splitlines()
+        except IOError as e:
+            sys.stderr.write('! Failed to read script: %s\n' % e)
+            self.set_rv(1)
+            return
+        slots = threading.BoundedSemaphore(self.max_jobs)
+        # jobs not yet printed, in script order
+        pending = []
+        # data name => the job last storing it, and the jobs using it since
+        writers = {}
+        readers = {}
+        failures = []
+
+        def flush(wait=False):
+            # print finished jobs, stopping at the first one still running
+            while pending and (wait or pending[0].done()):
+                job = pending.pop(0)
+                job.join()
+                job.replay()
+                if job.rv:
+                    failures.append(job)
+
+        for (num, line) in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                (parallel, needs, produces) = self.script_deps(line)
+            except Exception:
+                # e.g. an unbalanced quote; run it on its own below, to be reported like any other failing line
+                (parallel, needs, produces) = (False, set(), set())
+            if not parallel:
+                flush(wait=True)
+                writers.clear()
+                readers.clear()
+                self.last_rv = 0
+                try:
+                    keep_going = self.parse_cmd(line)
+                except Exception as e:
+                    sys.stderr.write('! %s\n' % e)
+                    self.set_rv(1)
+                    keep_going = True
+                if self.last_rv:
+                    failures.append(line)
+                if not keep_going:
+                    break
+                continue
+            after = set(writers[name] for name in needs | produces if name in writers)
+            for name in produces:
+                after.update(readers.get(name, []))
+            job = jobs.Job(num, line, functools.partial(self.parse_cmd, line), list(after), slots)
+            for name in needs:
+                readers.setdefault(name, []).append(job)
+            for name in produces:
+                writers[name] = job
+                readers[name] = []
+            pending.append(job.start())
+            flush()
+        flush(wait=True)
+        self.last_rv = int(bool(failures))
 
     def get_prompt(self):
         # : using colors messes up term spacing w/ readline history support
@@ -198,11 +677,32 @@ OTHER OPTIONS (may also be set via 'set' command)
    -O, --oauth CK CS T TS   Authenticate via OAuth using the supplied consumer key, secret, token, and token secret.
    -q, --quiet              Do not print API return response.
    -r, --raw                Don't format response data; return raw response.
+   --compact                With --raw, print JSON without indentation, spaces or key sorting.
+   --max-depth N            Collapse formatted output nested more than N levels deep into summaries.
+   --max-items N            Show at most N entries of each formatted list/dictionary.
+   --max-string N           Truncate formatted strings within responses after N characters.
    -s, --shell              Shell mode for running multiple APIs within a session.
+   --script FILE            Run the shell commands in FILE; independent GET/OPTIONS requests run in parallel.
+   --store FILE             Keep variables in memory (see --data) in an SQLite FILE instead, loading them as needed; they persist between sessions.
    -u, --url URL            URL to the API location (default: https://localhost/).
    -v, --verbose            Print verbose debugging info to stderr.
    -x, --extract PATH       Parse JSON/(X)HTML to only return requested data; may be repeated.
    -X, --exclude PATH       Exclude specified path from JSON data; may be repeated.
+   --table COLUMNS          Print extracted JSON records as CSV using the comma-separated column PATHs.
+   --tsv                    Separate --table columns with tabs instead of commas.
+   --aggregate PATH         Print count/sum/min/max/mean/percentiles of the numbers at PATH within extracted JSON records,
+                            with how many records had none there ("missing").
+   --group-by PATH          Group --aggregate results by the value at PATH within each record.
+   --sample N               Return a random sample of N values for each --extract PATH (e.g. 'items/*').
+   --limit N                Stop parsing JSON once N values have been extracted for each --extract PATH.
+   --parallel N             Most requests to run at once when a path expands over a list in memory (default: 8).
+   --profile                Profile the command, printing the time spent parsing, building the request, on the network, decoding, extracting and rendering, then the slowest functions.
+   --profile-dump FILE      Profile the command and also write its stats to FILE (e.g. for "python -m pstats FILE").
+   --stats-file FILE        On exit, write per-endpoint request counts, bytes, statuses and latency histograms to FILE in the Prometheus text format.
+   --har FILE               Record every request and response, with timings, to FILE in the HAR (HTTP Archive) format on exit.
+   --record DIR             Save each response in DIR, keyed by method, path, query and request body.
+   --playback DIR           Answer requests with the responses saved in DIR by --record, without using the network; unrecorded requests fail.
+   --stream                 Parse XML/HTML incrementally as it downloads when extracting data, for very large documents.
 
 API PARAMS
 ---------------------------------------------------------------------------
@@ -217,6 +717,8 @@ Dictionaries can be created on demand using dot notation. Multiple params within
 
 Variables in memory (e.g. shown by 'data' command) may be referenced using "+=" as the operator.
 
+Paths may also reference variables in memory as {NAME} (e.g. "get users/{ids}/profile"). If NAME holds a list, one request is made per item, --parallel at a time, and the results (and any --data) are collected into lists in the same order. Identical GETs in progress at the same time (e.g. for duplicate items, or from background jobs) share a single request.
+
 
 HTML/XML PATHS (--extract, --data)
 ---------------------------------------------------------------------------
@@ -248,10 +750,38 @@ SHELL COMMANDS
    set                      Set configuration options.
    config                   List current configuration infomation.
    sh CMD                   Run a BASH shell command.
-   data [NAME] [-=NAME]     List variables in memory, optionally by name; -= to remove from memory
-   env [NAME] [[+-]=NAME]   List environmental variables, optionally by name; += or -= to add/remove 'data' from the environment
+   ls [PATH]                List what is within the last JSON response, optionally at a PATH.
+   cat PATH                 Print the value(s) at PATH within the last JSON response.
+   tree [PATH] [--depth N]  Print the last JSON response (or PATH within it) N levels deep (default: 2).
+   data [NAME] [-=NAME]     List variables in memory with their sizes, or print them by name; -= to remove from memory
+   env [NAME] [[+-]=NAME]   List environmental variables, or print them by name; += or -= to add/remove 'data' from the environment
    > FILE                   Write API response to specified file.
    >> FILE                  Append API response to specified file.
+   | FORMATTER [ARGS]       Filter response output line by line; may be chained (e.g. "get items | grep name | head 5").
+                            Formatters: head/tail [-n N] [-c CHARS], grep [-v] [-i] REGEX, sort [-n] [-r], uniq [-c]
+   | CMD                    Pipe output into a shell command, after any formatters (e.g. "get items | jq ."); formatter names
+                            with options they lack run the command instead (e.g. "| grep -c id"). With --raw the body is
+                            streamed straight from the connection (e.g. "get export -r | gzip > out.gz").
+   CMD &                    Run a command in the background; output is held until 'fg' or 'wait'.
+   jobs                     List background jobs.
+   wait [ID ...]            Wait for all (or the given) background jobs and print their output.
+   fg ID                    Wait for a background job and print its output.
+   kill ID [ID ...]         Abandon background jobs, discarding their output and any data they would store.
+   watch [-n INTERVAL] [-c COUNT] CMD
+                            Re-run a request every INTERVAL (e.g. 2s, 500ms; default: 2s), printing only what changed.
+   history [N]              List the last N (default: all remembered) responses.
+   show [ID] [ARGS]         Print a response from the history again (default: the last), e.g. "show 3 -x items/0";
+                            the request's query, headers and body are printed to stderr first.
+   stats [reset]            List requests by endpoint (method and path, with IDs as {id}), slowest in total first: count, time, bytes and status classes.
+   replay-har FILE [--speed FACTOR] [-c N] [-u URL]
+                            Replay the requests in a HAR file, keeping the gaps between them divided by FACTOR (e.g. 10x; default: 1),
+                            N at a time (default: 10), optionally against another URL; then compare latencies with the recording.
+   serve-fixtures DIR [--port N] [--latency DURATION] [--size SIZE] [--status CODE] [--chunked SIZE] [--gzip] [--per-page N]
+                            Serve the files in DIR (and generated payloads of SIZE under /_gen/json, ndjson, html and xml) on
+                            localhost:N (default: 8000) for benchmarking, with the given latency, status, chunking, gzip and Link
+                            pagination; requests may override each with query parameters (e.g. "?latency=50ms&per_page=100&page=2").
+
+Tab completes commands, options, variable names and API paths. Paths are learned from responses in the shell (including record IDs and links) and from OPTIONS requests made in the background, and are cached per base URL in ~/.rest-cli_completion.
 
 EXAMPLES:
 ---------------------------------------------------------------------------
@@ -274,14 +804,34 @@ EXAMPLES:
             'data': [],
             'extract': [],
             'exclude': [],
+            'table': None,
+            'table_delimiter': ',',
+            'aggregate': None,
+            'group_by': None,
+            'sample': None,
+            'limit': None,
+            'stream': False,
             'invert_color': False,
             'color': self.main_args['color'],
             'formatted': self.main_args['formatted'],
+            'compact': self.main_args['compact'],
+            'max_depth': self.main_args['max_depth'],
+            'max_items': self.main_args['max_items'],
+            'max_string': self.main_args['max_string'],
+            'parallel': self.main_args['parallel'],
             'url': self.main_args['url'],
             'verbose': False,
             'stdout_redir': None,
             'redir_type': None,
             'shell': False,
+            'script': None,
+            'store': None,
+            'profile': self.main_args['profile'],
+            'profile_dump': self.main_args['profile_dump'],
+            'stats_file': self.main_args['stats_file'],
+            'har': self.main_args['har'],
+            'record': None,
+            'playback': None,
             'query': [],
             'help': False,  # user just wanted some help
             'FILES': [],
@@ -296,24 +846,18 @@ EXAMPLES:
             parts = shlex.split(expr)
         else:
             parts = expr  # already a list
-        # check for any condensed parameters (e.g. -fr = -f, -r)
-        old_parts = parts[:]
-        for i in range(0, len(parts)):
-            part = parts[i]
-            if len(part) > 2 and part[0] == '-' and not (part[1] in ['-', '+', '=']):
-                # expand the parameters out
-                parts = parts[:i] + \
-                    [''.join(['-', param]) for param in parts[i][1:]] + \
-                    parts[i + 1:]
+        parts = self.expand_flags(parts)
         i = 0
         # iterate through each paramter and handle it
         while i < len(parts):
             part = parts[i]
-            if len(part) == 0:
+            if args['verb'] in self.raw_cmds:
+                args['cmd_args'].append(part)
+            elif len(part) == 0:
                 pass
             elif part == '>' or part[0] == '>' or part == '>>':
                 # output redirection! woot
-                if part == '>' or parts == '>>':
+                if part == '>' or part == '>>':
                     i += 1
                     if part == '>':
                         args['redir_type'] = 'w'
@@ -391,6 +935,39 @@ EXAMPLES:
                 args['headers'][h_parts[0].lower()] = h_parts[1]
             elif part == '-s' or part == '--shell':
                 args['shell'] = True
+            elif part == '--profile':
+                args['profile'] = True
+            elif part == '--record' or part == '--playback':
+                i += 1
+                if i == len(parts):
+                    raise Exception("Missing cassette directory for %s." % part)
+                args[part[2:]] = parts[i]
+            elif part == '--har':
+                i += 1
+                if i == len(parts):
+                    raise Exception("Missing file to record requests to.")
+                args['har'] = parts[i]
+            elif part == '--stats-file':
+                i += 1
+                if i == len(parts):
+                    raise Exception("Missing file to write request stats to.")
+                args['stats_file'] = parts[i]
+            elif part == '--profile-dump':
+                i += 1
+                if i == len(parts):
+                    raise Exception("Missing file to write profile stats to.")
+                args['profile'] = True
+                args['profile_dump'] = parts[i]
+            elif part == '--store':
+                i += 1
+                if i == len(parts):
+                    raise Exception("Missing file to keep variables in.")
+                args['store'] = parts[i]
+            elif part == '--script':
+                i += 1
+                if i == len(parts):
+                    raise Exception("Missing script file to run.")
+                args['script'] = parts[i]
             elif part == '-j' or part == '--json':
                 i += 1
                 if i == len(parts):
@@ -409,6 +986,20 @@ EXAMPLES:
                     raise JSONException(e.message)
             elif part == '-r' or part == '--raw':
                 args['formatted'] = False
+            elif part == '--compact':
+                args['compact'] = True
+            elif part == '--stream':
+                args['stream'] = True
+            elif part == '--parallel':
+                i += 1
+                if i == len(parts):
+                    raise Exception("Missing value for --parallel.")
+                args['parallel'] = max(1, int(parts[i]))
+            elif part in ('--max-depth', '--max-items', '--max-string'):
+                i += 1
+                if i == len(parts):
+                    raise Exception("Missing value for %s." % part)
+                args[part[2:].replace('-', '_')] = int(parts[i]) or None
             elif part == '--url' or part == '-u':
                 i += 1
                 if i == len(parts):
@@ -432,6 +1023,28 @@ EXAMPLES:
                 if i == len(parts):
                     raise Exception("Missing value for --exclude.")
                 args['exclude'].append(parts[i])
+            elif part == '--table':
+                i += 1
+                if i == len(parts):
+                    raise Exception("Missing column paths for --table.")
+                args['table'] = parts[i].split(',')
+            elif part == '--tsv':
+                args['table_delimiter'] = '\t'
+            elif part == '--aggregate':
+                i += 1
+                if i == len(parts):
+                    raise Exception("Missing value for --aggregate.")
+                args['aggregate'] = parts[i]
+            elif part == '--group-by':
+                i += 1
+                if i == len(parts):
+                    raise Exception("Missing value for --group-by.")
+                args['group_by'] = parts[i]
+            elif part == '--sample' or part == '--limit':
+                i += 1
+                if i == len(parts):
+                    raise Exception("Missing number of values for %s." % part)
+                args[part[2:]] = int(parts[i])
             else:
                 # we always pick up the command/method first
                 if args['verb'] is None:
@@ -454,16 +1067,111 @@ EXAMPLES:
             args = util.get_args(arg_slice, args)
         return args
 
+    def expand_flags(self, parts):
+        '''Expand any condensed parameters (e.g. -fr = -f, -r).'''
+        for i in range(0, len(parts)):
+            part = parts[i]
+            if len(part) > 2 and part[0] == '-' and not (part[1] in ['-', '+', '=']):
+                # expand the parameters out
+                parts = parts[:i] + \
+                    [''.join(['-', param]) for param in parts[i][1:]] + \
+                    parts[i + 1:]
+        return parts
+
+    def split_pipeline(self, expr, max_splits=None):
+        '''Split a command line on each unquoted pipe (e.g. "get items | head 20" => ["get items", "head 20"]), leaving anything after max_splits pipes as-is.'''
+        segments = []
+        current = []
+        quote = None
+        escaped = False
+        for (i, char) in enumerate(expr):
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif quote:
+                if char == quote:
+                    quote = None
+            elif char in ('"', "'"):
+                quote = char
+            elif char == '|':
+                segments.append(''.join(current).strip())
+                current = []
+                if max_splits is not None and len(segments) == max_splits:
+                    segments.append(expr[i + 1:].strip())
+                    return segments
+                continue
+            current.append(char)
+        segments.append(''.join(current).strip())
+        return segments
+
+    def parse_formatter(self, expr):
+        '''Parse an output formatter stage of a pipeline (e.g. "grep -v id") into the formatter class and its arguments.'''
+        parts = shlex.split(expr)
+        if not parts:
+            raise Exception('Missing formatter after "|".')
+        name = parts[0].lower()
+        if name not in formatters:
+            raise Exception('Unknown output formatter "%s"; available: %s.' % (
+                name, ', '.join(sorted(formatters))
+            ))
+        return (formatters[name], formatters[name].parse_args(parts[1:]))
+
+    def formatter_stage(self, segment):
+        '''Returns (formatter class, arguments) for a pipeline stage our output formatters can handle, or None if it's for the OS shell: not a formatter, or using options ours lack (e.g. "grep -c foo", "sort -k2").'''
+        parts = shlex.split(segment)
+        if not parts or parts[0].lower() not in formatters:
+            return None
+        try:
+            return self.parse_formatter(segment)
+        except Exception:
+            return None
+
     def parse_cmd(self, cli_cmd):
         '''
         Parse a shell command to either run an internal command or perform an HTTP request. Returns True if a command was successfully parsed, false if the user wants to quit, or throws an exception with a syntax or run-time/request error.
 
         Commands/requests are executed using the current environment and/or base arguments.
 
-        By default, responses are printed to standard-out based on the run-time parameters. Output can be piped to write/append files like a normal shell (e.g. if using inside the rest shell).
+        By default, responses are printed to standard-out based on the run-time parameters. Output can be piped to write/append files like a normal shell (e.g. if using inside the rest shell), through output formatters (e.g. "get items | grep name | head 20"), and on into shell commands (e.g. "get items | grep name | sort | less").
         '''
+        pipeline = []
+        # the shell command output is piped into, if any
+        command = None
+        if isinstance(cli_cmd, basestring) and cli_cmd.rstrip().endswith('&') \
+                and not cli_cmd.rstrip().endswith('\\&'):
+            return self.background(cli_cmd.rstrip()[:-1].strip())
+        (profile, dump) = self.profile_options(cli_cmd)
+        if profile and profiling.current() is None:
+            # run ourself again, this time under the profiler
+            return profiling.profile(functools.partial(self.parse_cmd, cli_cmd), dump)
+        if isinstance(cli_cmd, basestring):
+            segments = self.split_pipeline(cli_cmd, 1)
+            cli_cmd = segments[0]
+            # our formatters come first, then anything else is for the OS shell
+            while len(segments) > 1:
+                segments = self.split_pipeline(segments[1], 1)
+                stage = self.formatter_stage(segments[0])
+                if stage is None:
+                    command = ' | '.join(segments)
+                    break
+                pipeline.append(stage)
         # collect up the command parts
-        args = self.parse_args(cli_cmd)
+        args = profiling.timed('parse', self.parse_args, cli_cmd)
+        for mode in ('record', 'playback'):
+            if args[mode] and args[mode] != self.args[mode]:
+                # a cassette is for the whole session, not one request
+                raise Exception('Use "set %s=%s" to %s responses from now on.' % (
+                    mode, args[mode], 'record' if mode == 'record' else 'play back'
+                ))
+        # raw bodies can go straight from the connection into a command
+        stream_raw = bool(command) and not (
+            pipeline or args['formatted'] or args['extract'] or args['exclude']
+            or args['data'] or args['table'] or args['aggregate'] is not None
+        )
+        if pipeline or command:
+            # escape codes would get in the way of matching/sorting lines
+            args['color'] = False
         # if we got oauth args we need to load in do so
         if args['oauth']['consumer_key']:
             self.client.load_oauth(args['oauth'])
@@ -478,25 +1186,38 @@ EXAMPLES:
             else:
                 # no command and not in shell mode? offer some help
                 self.print_help()
-                self.last_rv = 1
+                self.set_rv(1)
                 return True
         elif args['verb'] in self.http_methods:
             # run an API
             try:
                 args['api_args'].update(self.env('vars'))
-                answer = self.client.request(
-                    method=args['verb'],
-                    path=args['path'],
-                    params=args['api_args'],
-                    query=args['query'],
-                    headers=args['headers'],
-                    verbose=args['verbose'],
-                    basic_auth=args['basic_auth'],
-                    full=True
-                )
-                response = answer.decoded
-                response_status = None
-                success = True
+                started = time.time()
+                path = self.expand_path(args['path'])
+                if isinstance(path, list):
+                    (response, failures) = self.fan_out(path, args)
+                    success = not failures
+                    response_status = '%d of %d requests failed' % (failures, len(path)) if failures else None
+                else:
+                    answer = self.client.request(
+                        method=args['verb'],
+                        path=path,
+                        params=args['api_args'],
+                        query=args['query'],
+                        headers=args['headers'],
+                        verbose=args['verbose'],
+                        basic_auth=args['basic_auth'],
+                        full=True,
+                        # let jsonx scan the raw body for samples/limits
+                        decode=not (args['extract'] and (args['sample'] or args['limit'])),
+                        stream=args['stream'] or stream_raw
+                    )
+                    if args['stream'] and not stream_raw and not self.is_streamable(answer, args):
+                        # nothing to pull out along the way, so just read it all
+                        answer = self.client.read_body(answer)
+                    response = answer.decoded
+                    response_status = None
+                    success = True
             except client.APIException as e:
                 success = False
                 response_status = e.message
@@ -514,13 +1235,54 @@ EXAMPLES:
                 assert False, "Socket errors shouldn't happen anymore..."
                 success = False
                 response = unicode(e)
-            self.last_rv = int(not success)
+            self.set_rv(int(not success))
+            job = jobs.current_job()
+            if job and job.killed:
+                # abandoned while in flight; leave what we have alone
+                return True
+            if answer:
+                self.last_response = answer
+                self.history.add(args['verb'], path, answer, time.time() - started)
+                if success and self.args['shell']:
+                    # only the interactive shell completes paths; one-off commands and scripts leave no cache behind
+                    self.path_index().learn(path, answer.decoded, answer.meta.headers)
             # prep response redirection, since it worked
             if args['stdout_redir'] is not None:
                 try:
                     file = open(args['stdout_redir'], args['redir_type'])
                 except IOError as e:
-                    sys.stderr.write('! Failed to write response: ' + e + '\n')
+                    sys.stderr.write('! Failed to write response: %s\n' % e)
+                    return True
+        elif args['verb'] == 'show':
+            # replay a response from the history as if it had just arrived
+            try:
+                if len(args['cmd_args']) > 1:
+                    raise Exception('Usage: show [ID] [ARGS]')
+                entry = self.history.get(args['cmd_args'][0] if args['cmd_args'] else None)
+                # what was asked goes to stderr, so the response can still be piped or redirected on its own
+                sys.stderr.write('# Request: %s %s\n' % (entry.method, entry.request_path))
+                if entry.request_headers:
+                    sys.stderr.write('# Request Headers: %s\n' % ', '.join(
+                        '%s: %s' % (name, value) for (name, value) in entry.request_headers
+                    ))
+                if entry.payload:
+                    sys.stderr.write('# Request Body: %s\n' % entry.payload)
+                answer = entry.response()
+                response = answer.decoded
+                success = answer.meta.status_int < 400
+                response_status = None if success else '"%s %s" failed (%s)' % (
+                    entry.method, entry.path, entry.status
+                )
+                self.last_response = answer
+            except Exception as e:
+                success = False
+                response_status = 'Syntax Error'
+                response = e.message
+            if args['stdout_redir'] is not None:
+                try:
+                    file = open(args['stdout_redir'], args['redir_type'])
+                except IOError as e:
+                    sys.stderr.write('! Failed to write response: %s\n' % e)
                     return True
         else:
             # run an internal command
@@ -533,22 +1295,35 @@ EXAMPLES:
                 if args['verbose']:
                     print_exception(*sys.exc_info())
         # adjust the response object as requested
-        if answer and (args['extract'] or args['exclude'] or args['data']):
+        tabulated = args['table'] or args['aggregate'] is not None
+        if answer and (args['extract'] or args['exclude'] or args['data'] or tabulated):
             # handle HTML vs JSON differently
             content_type = answer.meta.headers.get('Content-Type')
             to_store = {}
             if content_type.startswith("application/json"):
                 try:
-                    response = jsonx(
+                    response = profiling.timed(
+                        'extract',
+                        jsonx,
                         response,
                         extract=args['extract'],
                         exclude=args['exclude'],
                         raw=True,
                         data_map=args['data'],
-                        data_store=to_store
+                        data_store=to_store,
+                        table=args['table'],
+                        table_delimiter=args['table_delimiter'],
+                        aggregate=args['aggregate'],
+                        group_by=args['group_by'],
+                        sample=args['sample'],
+                        limit=args['limit']
                     )
+                    if args['table']:
+                        # tables are printed as-is, without truncation
+                        response = '\n'.join(response)
+                        args['formatted'] = False
                     # if we only had one match return it instead of a single-element array for cleanliness
-                    if len(response) == 1:
+                    elif len(response) == 1:
                         response = response[0]
                 except:
                     (exc_type, exc_msg, exc_tb) = sys.exc_info()
@@ -558,12 +1333,28 @@ EXAMPLES:
                       xml_type in xml_content_types]):
                 # it looks like HTML so try parsing that out instead
                 try:
-                    response = htmlx(
-                        response,
-                        extract=args['extract'],
-                        data_map=args['data'],
-                        data_store=to_store
-                    )
+                    if hasattr(answer.raw, 'read'):
+                        try:
+                            response = profiling.timed(
+                                'extract',
+                                stream_htmlx,
+                                answer.raw,
+                                extract=args['extract'],
+                                data_map=args['data'],
+                                data_store=to_store,
+                                html=content_type.startswith('text/html')
+                            )
+                        finally:
+                            answer.raw.close()
+                    else:
+                        response = profiling.timed(
+                            'extract',
+                            htmlx,
+                            response,
+                            extract=args['extract'],
+                            data_map=args['data'],
+                            data_store=to_store
+                        )
                     # if we only had one match return it instead of a single-element array for cleanliness
                     if len(response) == 1:
                         response = response[0]
@@ -572,40 +1363,345 @@ EXAMPLES:
                     sys.stderr.write('! %s\n' % exc_msg)
                     return True
             # if we ended up storing any data, save it memory, noting any environmentals
-            for key in to_store:
-                # coerce single-values out of lists to stand on their own
-                if len(to_store[key]) == 1:
-                    to_store[key] = to_store[key][0]
-                clean_key = key
-                if key.endswith('+'):
-                    clean_key = key[:-1]
-                self.data_store[clean_key] = to_store[key]
-                if key.endswith('+'):
-                    self.env('vars')[clean_key] = to_store[key]
-        self._print_response(
+            self.store_data(to_store)
+        profiling.timed(
+            'render',
+            self._print_response,
             success,
             response,
             response_status,
             formatted=args['formatted'],
+            compact=args['compact'],
+            max_depth=args['max_depth'],
+            max_items=args['max_items'],
+            max_string=args['max_string'],
             color=args['color'],
             invert_color=args['invert_color'],
             stdout_redir=args['stdout_redir'],
             redir_type=args['redir_type'],
-            file=file
+            file=file,
+            pipeline=pipeline,
+            command=command
         )
         return True
 
+    def profile_options(self, cli_cmd):
+        '''Returns whether a command is to be profiled and where to dump the stats, if anywhere; checked before the command is parsed so parsing counts too.'''
+        parts = cli_cmd.split() if isinstance(cli_cmd, basestring) else list(cli_cmd)
+        dump = self.args['profile_dump']
+        if '--profile-dump' in parts[:-1]:
+            dump = parts[parts.index('--profile-dump') + 1]
+        return (bool(self.args['profile'] or '--profile' in parts or dump), dump)
+
+    def is_streamable(self, answer, args):
+        '''Whether a streamed response can have data extracted from it as it downloads (i.e. XML/HTML with something to extract).'''
+        content_type = answer.meta.headers.get('Content-Type') or ''
+        return bool(args['extract'] or args['data']) and any([
+            content_type.startswith(xml_type) for xml_type in xml_content_types
+        ])
+
+    def store_data(self, to_store, coerce=True):
+        '''Save data into memory by name; names ending in '+' are added to the env too. Single values are taken out of their lists unless coerce is off.'''
+        for key in to_store:
+            # coerce single-values out of lists to stand on their own
+            if coerce and len(to_store[key]) == 1:
+                to_store[key] = to_store[key][0]
+            clean_key = key
+            if key.endswith('+'):
+                clean_key = key[:-1]
+            self.data_store[clean_key] = to_store[key]
+            if key.endswith('+'):
+                self.env('vars')[clean_key] = to_store[key]
+
+    def print_summary(self, name, summary):
+        '''Print a line describing a variable without dumping its whole value (e.g. "ids  list[3]  9B  [1, 2, 3]").'''
+        sys.stdout.write('%-20s %-14s %8s  %s\n' % (
+            name, summary.kind, util.format_size(summary.size), summary.preview
+        ))
+
+    def filter_response(self, answer, args, data_store=None):
+        '''Returns the decoded response with the extract/exclude arguments applied, storing any --data into data_store if given.'''
+        response = answer.decoded
+        data_map = args['data'] if data_store is not None else None
+        if not (args['extract'] or args['exclude'] or data_map):
+            return response
+        content_type = answer.meta.headers.get('Content-Type') or ''
+        if content_type.startswith('application/json'):
+            response = jsonx(
+                response,
+                extract=args['extract'],
+                exclude=args['exclude'],
+                raw=True,
+                data_map=data_map,
+                data_store=data_store
+            )
+        elif any([content_type.startswith(xml_type) for xml_type in xml_content_types]):
+            response = htmlx(
+                response,
+                extract=args['extract'],
+                data_map=data_map,
+                data_store=data_store
+            )
+        if isinstance(response, list) and len(response) == 1:
+            response = response[0]
+        return response
+
+    def expand_path(self, path):
+        '''
+        Fill in references to variables in memory within a path (e.g. "users/{id}/profile"); unknown names are left as-is.
+
+        Returns a list of paths if any of the variables hold a list, one per item (several lists are paired up item by item), otherwise the single path.
+        '''
+        names = [name for name in re.findall(r'\{(\w+)\}', path) if name in self.data_store]
+        if not names:
+            return path
+        lists = dict(
+            (name, self.data_store[name]) for name in names
+            if isinstance(self.data_store[name], list)
+        )
+        if len(set(len(items) for items in lists.values())) > 1:
+            raise Exception('Unable to expand "%s"; the lists %s differ in length.' % (
+                path, ', '.join(sorted(lists))
+            ))
+
+        def fill(i):
+            def value(match):
+                name = match.group(1)
+                if name not in self.data_store:
+                    return match.group(0)
+                value = lists[name][i] if name in lists else self.data_store[name]
+                if not isinstance(value, basestring):
+                    value = self.encode(value)
+                return quote(value.encode('utf-8'), safe='')
+            return re.sub(r'\{(\w+)\}', value, path)
+
+        if not lists:
+            return fill(None)
+        return [fill(i) for i in range(len(lists.values()[0]))]
+
+    def fan_out(self, paths, args):
+        '''
+        Make the same request to each path, up to --parallel at a time. Returns the filtered responses (None for those that failed) in path order and the number of failures.
+
+        Any --data is stored as a list with an entry for each path.
+        '''
+        def fetch(path):
+            started = time.time()
+            answer = self.client.request(
+                method=args['verb'],
+                path=path,
+                params=args['api_args'],
+                query=args['query'],
+                headers=dict(args['headers']),
+                verbose=args['verbose'],
+                basic_auth=args['basic_auth'],
+                full=True
+            )
+            self.history.add(args['verb'], path, answer, time.time() - started)
+            to_store = {}
+            return (self.filter_response(answer, args, to_store), to_store)
+
+        results = []
+        collected = dict((key, []) for (key, path) in args['data'])
+        failures = 0
+        for (value, error) in jobs.run_all(fetch, paths, args['parallel']):
+            if error is not None:
+                failures += 1
+                sys.stderr.write('! %s\n' % error)
+                (response, to_store) = (None, {})
+            else:
+                (response, to_store) = value
+            results.append(response)
+            for key in collected:
+                found = to_store.get(key, [])
+                collected[key].append(found[0] if len(found) == 1 else found or None)
+        self.store_data(collected, coerce=False)
+        return (results, failures)
+
+    def watch(self, params):
+        '''
+        Re-issue a request on an interval (e.g. "watch -n 2s get jobs/42 -x status"), printing the first response in full and after that only what changed, until interrupted or COUNT requests have been made.
+
+        The request is only parsed once. If the server sends an ETag the following requests are conditional, with "304 Not Modified" meaning nothing changed.
+        '''
+        interval = 2.0
+        count = None
+        i = 0
+        while i < len(params) and params[i].startswith('-'):
+            if params[i] not in ('-n', '--interval', '-c', '--count'):
+                raise Exception('Unrecognized argument: %s' % params[i])
+            if i + 1 == len(params):
+                raise Exception('Missing value for %s.' % params[i])
+            if params[i] in ('-n', '--interval'):
+                interval = util.parse_duration(params[i + 1])
+            else:
+                count = int(params[i + 1])
+            i += 2
+        args = self.parse_args(params[i:])
+        if args['verb'] not in self.http_methods:
+            raise Exception('Usage: watch [-n INTERVAL] [-c COUNT] get PATH [ARGS]')
+        args['api_args'].update(self.env('vars'))
+        etag = None
+        previous = None
+        polls = 0
+        next_poll = time.time()
+        try:
+            while count is None or polls < count:
+                polls += 1
+                headers = dict(args['headers'])
+                if etag:
+                    headers['If-None-Match'] = etag
+                try:
+                    answer = self.client.request(
+                        method=args['verb'],
+                        path=args['path'],
+                        params=args['api_args'],
+                        query=args['query'],
+                        headers=headers,
+                        verbose=args['verbose'],
+                        basic_auth=args['basic_auth'],
+                        full=True
+                    )
+                except client.APIException as e:
+                    sys.stderr.write('! %s: %s\n' % (time.strftime('%H:%M:%S'), e.message))
+                    answer = None
+                if answer is not None and answer.meta.status_int != 304:
+                    etag = answer.meta.headers.get('ETag')
+                    current = self.filter_response(answer, args)
+                    if polls == 1:
+                        self._print_response(
+                            True,
+                            current,
+                            formatted=args['formatted'],
+                            compact=args['compact'],
+                            max_depth=args['max_depth'],
+                            max_items=args['max_items'],
+                            max_string=args['max_string'],
+                            color=args['color'],
+                            invert_color=args['invert_color']
+                        )
+                    else:
+                        self.print_diff(previous, current)
+                    previous = current
+                sys.stdout.flush()
+                if count is not None and polls >= count:
+                    break
+                next_poll += interval
+                time.sleep(max(0, next_poll - time.time()))
+        except KeyboardInterrupt:
+            sys.stderr.write('\n')
+
+    def print_diff(self, old, new):
+        '''Print the changes between two responses, one per line (e.g. "~ status: "running" => "done"").'''
+        changes = list(diff(old, new))
+        if not changes:
+            return
+        sys.stdout.write('# %s: %d change%s\n' % (
+            time.strftime('%H:%M:%S'), len(changes), '' if len(changes) == 1 else 's'
+        ))
+        for (op, path, old_value, new_value) in changes:
+            if op == '~':
+                sys.stdout.write('~ %s: %s => %s\n' % (
+                    path or '/', self.encode(old_value), self.encode(new_value)
+                ))
+            elif op == '+':
+                sys.stdout.write('+ %s: %s\n' % (path, self.encode(new_value)))
+            else:
+                sys.stdout.write('- %s: %s\n' % (path, self.encode(old_value)))
+
+    def render_chunks(self, response, **args):
+        '''Yield the printable text of a response in pieces as it is rendered, without truncation.'''
+        if isinstance(response, basestring):
+            return [response]
+        if args.get('formatted'):
+            return dbg.iter_obj(
+                response,
+                color=args.get('color'),
+                invert_color=args.get('invert_color'),
+                max_depth=args.get('max_depth'),
+                max_items=args.get('max_items'),
+                max_string=args.get('max_string')
+            )
+        return iter_json(response, compact=args.get('compact'))
+
+    def pipeline_lines(self, response, pipeline=None, **args):
+        '''Returns the lines of a response's output after passing through a chain of output formatters.'''
+        lines = OutputFormatter(lines_from_chunks(self.render_chunks(response, **args)))
+        for (formatter, opts) in pipeline or []:
+            lines = formatter(lines)(**opts)
+        return lines
+
+    def run_pipeline(self, response, stream, pipeline=None, **args):
+        '''Write a response's output to the stream through a chain of output formatters, one line at a time.'''
+        lines = self.pipeline_lines(response, pipeline, **args)
+        encoding = getattr(stream, 'encoding', None) or 'utf-8'
+        for line in lines:
+            if isinstance(line, unicode):
+                line = line.encode(encoding, 'ignore')
+            stream.write(line + '\n')
+
+    def run_command(self, response, command, pipeline=None, **args):
+        '''
+        Feed a response into a shell command (e.g. "get export -r | gzip > out.gz") as it is produced.
+
+        A body still on the connection is copied over in raw chunks as they arrive; anything else is rendered (and passed through any formatters) a piece at a time. Writes wait for the command to keep up, so nothing piles up in memory.
+        '''
+        proc = subprocess.Popen(
+            command,
+            shell=True,
+            stdin=subprocess.PIPE,
+            stdout=args['file'] if args.get('stdout_redir') is not None else None,
+            bufsize=-1,
+            # let the command die quietly if whatever it writes to goes away (e.g. "| head")
+            preexec_fn=lambda: signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+        )
+        try:
+            if hasattr(response, 'read'):
+                chunks = iter(lambda: response.read(self.pipe_chunk_size), '')
+            elif pipeline:
+                chunks = (line + '\n' for line in self.pipeline_lines(response, pipeline, **args))
+            else:
+                chunks = self.render_chunks(response, **args)
+            for chunk in chunks:
+                if isinstance(chunk, unicode):
+                    chunk = chunk.encode('utf-8')
+                proc.stdin.write(chunk)
+        except IOError as e:
+            # the command stopped reading early, which is fine
+            if e.errno != errno.EPIPE:
+                raise
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+            try:
+                proc.stdin.close()
+            except IOError:
+                pass
+            rv = proc.wait()
+        if rv:
+            sys.stderr.write('! "%s" exited with status %d\n' % (command, rv))
+            self.set_rv(rv)
+
     def _print_response(self, success, response, status=None, **args):
         if success:
-            if response is not None:
+            if response is not None and args.get('command'):
+                self.run_command(response, **args)
+                if args.get('stdout_redir') is not None:
+                    args['file'].close()
+            elif response is not None and args.get('pipeline'):
+                stream = sys.stdout
+                if args.get('stdout_redir') is not None:
+                    stream = args['file']
+                self.run_pipeline(response, stream, **args)
+                if stream is not sys.stdout:
+                    stream.close()
+            elif response is not None:
                 if 'stdout_redir' in args and args['stdout_redir'] is not None:
-                    #response = json.dumps(
-                    #    response,
-                    #    ensure_ascii=True,
-                    #    sort_keys=True,
-                    #    indent=4
-                    #)
-                    args['file'].write(dbg.obj2str(response, color=False))
+                    if args.get('formatted') or isinstance(response, basestring):
+                        args['file'].write(dbg.obj2str(response, color=False))
+                    else:
+                        write_json(response, args['file'], compact=args.get('compact'))
+                        args['file'].write('\n')
                     args['file'].close()
                 else:
                     if isinstance(response, basestring):
@@ -628,10 +1724,14 @@ EXAMPLES:
                             dbg.pretty_print(
                                 response,
                                 color=args.get('color'),
-                                invert_color=args.get('invert_color')
+                                invert_color=args.get('invert_color'),
+                                max_depth=args.get('max_depth'),
+                                max_items=args.get('max_items'),
+                                max_string=args.get('max_string')
                             )
                         else:
-                            print json.dumps(response, indent=4, sort_keys=True)
+                            write_json(response, sys.stdout, compact=args.get('compact'))
+                            sys.stdout.write('\n')
         else:
             if isinstance(response, basestring):
                 if args['formatted']:
@@ -652,10 +1752,14 @@ EXAMPLES:
                     dbg.pretty_print(
                         response,
                         color=args.get('color'),
-                        invert_color=args.get('invert_color')
+                        invert_color=args.get('invert_color'),
+                        max_depth=args.get('max_depth'),
+                        max_items=args.get('max_items'),
+                        max_string=args.get('max_string')
                     )
                 else:
-                    print json.dumps(response, indent=4, sort_keys=True)
+                    write_json(response, sys.stdout, compact=args.get('compact'))
+                    sys.stdout.write('\n')
 
     def env(self, key, value=None):
         '''Fetch or set a value from the environment.'''
@@ -752,6 +1856,40 @@ EXAMPLES:
             final_path = final_path + '/'
         return final_path
 
+    def last_document(self):
+        '''Returns the decoded body of the last JSON response, decoding it now if that was skipped when it was received.'''
+        if self.last_response is None:
+            raise Exception('No response yet; run a request first.')
+        content_type = self.last_response.meta.headers.get('Content-Type') or ''
+        if not content_type.startswith('application/json'):
+            raise Exception('The last response was not JSON (%s).' % (content_type or 'no content type'))
+        if hasattr(self.last_response.raw, 'read'):
+            raise Exception('The last response was streamed rather than kept; run the request again without piping it.')
+        if isinstance(self.last_response.decoded, basestring):
+            self.last_response = self.last_response._replace(
+                decoded=self.decode(self.last_response.decoded)
+            )
+        return self.last_response.decoded
+
+    def find_in_document(self, path):
+        '''Returns the (path, key, value) matches for a JSON path within the last response; a blank path is the whole document.'''
+        path = path.strip('/')
+        document = self.last_document()
+        if not path:
+            return [('/', None, document)]
+        return extract_path(document, path)
+
+    def describe(self, value, max_len=60):
+        '''A short, one-line description of a value that never renders its contents.'''
+        if isinstance(value, dict):
+            return '{%s keys}' % '{:,}'.format(len(value))
+        if isinstance(value, list):
+            return '[%s items]' % '{:,}'.format(len(value))
+        text = self.encode(value)
+        if len(text) > max_len:
+            text = '%s... (%s chars)' % (text[0:max_len], '{:,}'.format(len(text)))
+        return text
+
     def run_cmd(self, cmd, params=None):
         '''Run a command using the specified parameters.'''
         if params is None:
@@ -759,18 +1897,30 @@ EXAMPLES:
         if cmd == 'set':
             # break the array into the parts
             for str in params:
-                pair = self.parse_param(str)
+                pair = self.parse_param(str, {})
                 param = pair.keys()[0]
                 val = pair[param]
                 if not (param in self.args):
                     raise Exception('Unrecognized parameter: "%s". Enter "%shelp" or "%sh" for help.' % (param, self._cmd_char, self._cmd_char))
-                if param in ['invert', 'color', 'formatted', 'verbose', 'headers']:
+                if param in ['invert', 'color', 'formatted', 'compact', 'verbose', 'headers', 'profile']:
                     # just so there is no confusion on these...
                     if val in ['1', 'true', 'True']:
                         val = True
                     elif val in ['0', 'false', 'False']:
                         val = False
                     self.args[param] = val
+                elif param == 'parallel':
+                    self.args[param] = max(1, int(val))
+                elif param in ['max_depth', 'max_items', 'max_string']:
+                    # 0 or blank turns the limit off
+                    self.args[param] = int(val or 0) or None
+                elif param == 'har':
+                    self.record_har(val or None)
+                elif param in ['record', 'playback']:
+                    self.use_cassette(param, val or None)
+                elif param in ['profile_dump', 'stats_file']:
+                    # blank stops writing them
+                    self.args[param] = val or None
                 elif param == 'edit_mode':
                     self.set_edit_mode(val)
                 else:
@@ -778,7 +1928,9 @@ EXAMPLES:
         elif cmd == 'env':
             sys.stdout.write('ENV:\n')
             if not params:
-                params = self.env('vars').keys()
+                for name in sorted(self.env('vars')):
+                    self.print_summary(name, store.summarize(self.env('vars')[name]))
+                return True
             for param in params:
                 remove = False
                 add = False
@@ -807,7 +1959,9 @@ EXAMPLES:
         elif cmd == 'data':
             sys.stdout.write('DATA:\n')
             if not params:
-                params = self.data_store.keys()
+                for name in sorted(self.data_store):
+                    self.print_summary(name, self.data_store.summary(name))
+                return True
             for param in params:
                 remove = False
                 if param.startswith('-='):
@@ -836,6 +1990,114 @@ EXAMPLES:
             self.print_help()
         elif cmd == 'sh':
             proc = subprocess.Popen(params)
+        elif cmd == 'ls':
+            for (path, key, value) in self.find_in_document(params[0] if params else ''):
+                if isinstance(value, dict):
+                    entries = sorted(value.iteritems())
+                elif isinstance(value, list):
+                    entries = enumerate(value)
+                else:
+                    sys.stdout.write('%s = %s\n' % (path, self.describe(value)))
+                    continue
+                if len(params) > 0:
+                    sys.stdout.write('%s:\n' % path)
+                for (key, item) in entries:
+                    name = unicode(key)
+                    if isinstance(item, (dict, list)):
+                        name += '/'
+                    sys.stdout.write('%-24s %s\n' % (name, self.describe(item)))
+        elif cmd == 'cat':
+            if not params:
+                raise Exception('Missing PATH to print from the last response.')
+            found = [value for (path, key, value) in self.find_in_document(params[0])]
+            dbg.pretty_print(
+                found[0] if len(found) == 1 else found,
+                color=self.args['color'],
+                max_depth=self.args['max_depth'],
+                max_items=self.args['max_items'],
+                max_string=self.args['max_string']
+            )
+        elif cmd == 'tree':
+            path = ''
+            depth = 2
+            i = 0
+            while i < len(params):
+                if params[i] == '--depth':
+                    i += 1
+                    if i == len(params):
+                        raise Exception('Missing value for --depth.')
+                    depth = int(params[i])
+                else:
+                    path = params[i]
+                i += 1
+            found = [value for (path, key, value) in self.find_in_document(path)]
+            dbg.pretty_print(
+                found[0] if len(found) == 1 else found,
+                color=self.args['color'],
+                max_depth=depth,
+                max_items=self.args['max_items'],
+                max_string=self.args['max_string']
+            )
+        elif cmd == 'watch':
+            self.watch(params)
+        elif cmd == 'replay-har':
+            self.replay_har(params)
+        elif cmd == 'serve-fixtures':
+            self.serve_fixtures(params)
+        elif cmd == 'history':
+            entries = list(self.history)
+            if params:
+                entries = entries[-int(params[0]):]
+            for entry in entries:
+                sys.stdout.write('%5d  %s  %-7s %-32s %-24s %8s %8s%s\n' % (
+                    entry.id,
+                    time.strftime('%H:%M:%S', time.localtime(entry.time)),
+                    entry.method,
+                    entry.request_path,
+                    entry.status,
+                    util.format_size(entry.size),
+                    '%.3fs' % entry.elapsed if entry.elapsed is not None else '-',
+                    '  (on disk)' if entry.spill_path else ''
+                ))
+        elif cmd == 'stats':
+            if params == ['reset']:
+                self.client.stats.reset()
+                return True
+            if params:
+                raise Exception('Usage: stats [reset]')
+            sys.stdout.write('%-7s %-32s %6s %9s %8s %8s %8s %8s  %s\n' % (
+                'METHOD', 'PATH', 'COUNT', 'TOTAL', 'MEAN', '~P95', 'MAX', 'BYTES', 'STATUSES'
+            ))
+            for endpoint in self.client.stats:
+                sys.stdout.write('%-7s %-32s %6d %8.3fs %7.3fs %7.3fs %7.3fs %8s  %s\n' % (
+                    endpoint.method,
+                    endpoint.path,
+                    endpoint.count,
+                    endpoint.seconds,
+                    endpoint.seconds / endpoint.count,
+                    endpoint.percentile(95),
+                    endpoint.max,
+                    util.format_size(endpoint.bytes),
+                    ' '.join('%s:%d' % item for item in sorted(endpoint.statuses.items()))
+                ))
+        elif cmd == 'jobs':
+            for job in self.jobs.values():
+                sys.stdout.write('[%d] %-8s %8.2fs  %s\n' % (
+                    job.id, job.status(), job.elapsed(), job.command
+                ))
+        elif cmd == 'wait':
+            self.wait_jobs(params or self.jobs.keys())
+        elif cmd == 'fg':
+            if len(params) != 1:
+                raise Exception('Usage: fg ID')
+            self.wait_jobs(params)
+        elif cmd == 'kill':
+            if not params:
+                raise Exception('Usage: kill ID [ID ...]')
+            for job in [self.get_job(id) for id in params]:
+                job.kill()
+                del self.jobs[job.id]
+                sys.stderr.write('[%d] killed  %s\n' % (job.id, job.command))
         else:
             raise Exception('Unrecognized command: "%s". Enter "help" for help.' % (cmd))
         return True
@@ -0,0 +1,136 @@
+"""Per-endpoint request statistics: counts, bytes, status classes and latency histograms, keyed by method and path template."""
+
+import os
+import re
+import tempfile
+import threading
+
+
+# latency histogram bucket upper bounds, in seconds (the Prometheus client defaults)
+buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# path segments that look like IDs: numbers, UUIDs and long hex/base64-ish tokens containing a digit
+_id_re = re.compile(
+    r'^(\d+|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|(?=[\w-]*\d)[\w-]{16,})$',
+    re.I
+)
+
+
+def template(path):
+    '''Returns the path with any query string dropped and ID-like segments replaced (e.g. "/users/42/posts?page=2" => "/users/{id}/posts").'''
+    segments = path.split('?', 1)[0].split('/')
+    return '/'.join('{id}' if _id_re.match(segment) else segment for segment in segments)
+
+
+class Endpoint(object):
+    """Running totals for requests to one method and path template."""
+
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.count = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.max = 0.0
+        # e.g. {'2xx': 10, '4xx': 1}
+        self.statuses = {}
+        # requests by histogram bucket (not cumulative); the last counts those slower than every bound
+        self.latencies = [0] * (len(buckets) + 1)
+
+    def add(self, status, size, elapsed):
+        self.count += 1
+        self.bytes += size
+        self.seconds += elapsed
+        self.max = max(self.max, elapsed)
+        status_class = '%dxx' % (status // 100)
+        self.statuses[status_class] = self.statuses.get(status_class, 0) + 1
+        for (i, bound) in enumerate(buckets):
+            if elapsed <= bound:
+                self.latencies[i] += 1
+                break
+        else:
+            self.latencies[-1] += 1
+
+    def percentile(self, percent):
+        '''Returns the upper bound of the bucket the given percentile falls in (the max if beyond every bucket).'''
+        wanted = self.count * percent / 100.0
+        seen = 0
+        for (i, bound) in enumerate(buckets):
+            seen += self.latencies[i]
+            if seen >= wanted:
+                return min(bound, self.max)
+        return self.max
+
+
+class Stats(object):
+    """Endpoint totals for every response received, safe to add to from several threads."""
+
+    def __init__(self):
+        self.endpoints = {}
+        self.lock = threading.Lock()
+
+    def add(self, method, path, status, size, elapsed):
+        key = (method.upper(), template(path))
+        with self.lock:
+            if key not in self.endpoints:
+                self.endpoints[key] = Endpoint(*key)
+            self.endpoints[key].add(status, size, elapsed)
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = {}
+
+    def __iter__(self):
+        '''Iterate over the endpoints, those taking the most time in all first.'''
+        with self.lock:
+            endpoints = list(self.endpoints.values())
+        return iter(sorted(endpoints, key=lambda endpoint: -endpoint.seconds))
+
+    def prometheus(self):
+        '''Returns the totals in the Prometheus text exposition format.'''
+        lines = [
+            '# HELP rest_cli_requests_total Responses received, by endpoint and status class.',
+            '# TYPE rest_cli_requests_total counter'
+        ]
+        endpoints = list(self)
+        for endpoint in endpoints:
+            for (status_class, count) in sorted(endpoint.statuses.items()):
+                lines.append('rest_cli_requests_total{%s,status="%s"} %d' % (
+                    _labels(endpoint), status_class, count
+                ))
+        lines.extend([
+            '# HELP rest_cli_response_bytes_total Response body bytes received, by endpoint.',
+            '# TYPE rest_cli_response_bytes_total counter'
+        ])
+        for endpoint in endpoints:
+            lines.append('rest_cli_response_bytes_total{%s} %d' % (_labels(endpoint), endpoint.bytes))
+        lines.extend([
+            '# HELP rest_cli_request_duration_seconds Time from sending a request to receiving its body, by endpoint.',
+            '# TYPE rest_cli_request_duration_seconds histogram'
+        ])
+        for endpoint in endpoints:
+            labels = _labels(endpoint)
+            seen = 0
+            for (bound, count) in zip(buckets, endpoint.latencies):
+                seen += count
+                lines.append('rest_cli_request_duration_seconds_bucket{%s,le="%s"} %d' % (labels, bound, seen))
+            lines.append('rest_cli_request_duration_seconds_bucket{%s,le="+Inf"} %d' % (labels, endpoint.count))
+            lines.append('rest_cli_request_duration_seconds_sum{%s} %f' % (labels, endpoint.seconds))
+            lines.append('rest_cli_request_duration_seconds_count{%s} %d' % (labels, endpoint.count))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        '''Write the totals to a file in the Prometheus text format, replacing it in one go so collectors never read half of it.'''
+        directory = os.path.dirname(os.path.abspath(path))
+        (fd, tmp_path) = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as metrics:
+            metrics.write(self.prometheus())
+        os.rename(tmp_path, path)
+
+
+def _labels(endpoint):
+    return 'method="%s",path="%s"' % (_escape(endpoint.method), _escape(endpoint.path))
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,119 @@
+"""Storage for variables kept in memory by the shell (e.g. "-d ids=items/*/id"), optionally backed by an SQLite file."""
+
+import collections
+import sqlite3
+import threading
+try:
+    import json
+except:
+    import simplejson
+    json = simplejson
+
+
+Summary = collections.namedtuple('Summary', ['kind', 'size', 'preview'])
+
+
+def summarize(value, encoded=None, width=60):
+    '''Returns the type (with a count for lists/dicts), encoded size and a truncated preview of a value.'''
+    if encoded is None:
+        encoded = json.dumps(value)
+    kind = type(value).__name__
+    if isinstance(value, (list, dict)):
+        kind = '%s[%d]' % (kind, len(value))
+    preview = encoded if len(encoded) <= width else encoded[:width - 3] + '...'
+    return Summary(kind, len(encoded), preview)
+
+
+def _key(name):
+    return name.encode('utf-8') if isinstance(name, unicode) else name
+
+
+class DataStore(collections.MutableMapping):
+    """
+    A dictionary of variables; with a path, values live in an SQLite database instead of memory and are kept between sessions.
+
+    Values are stored JSON-encoded and only decoded when read, with the most recently read few kept decoded. A summary of each (see summarize) is kept in memory so listing variables never has to load or encode them.
+    """
+    cache_size = 4
+
+    def __init__(self, path=None):
+        self.path = path
+        self.summaries = {}
+        self.values = {}
+        self.cache = collections.OrderedDict()
+        # jobs may store data from other threads
+        self.lock = threading.RLock()
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.text_factory = str
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS data ('
+                'name TEXT PRIMARY KEY, value TEXT, kind TEXT, size INTEGER, preview TEXT)'
+            )
+            self.db.commit()
+            for (name, kind, size, preview) in self.db.execute('SELECT name, kind, size, preview FROM data'):
+                self.summaries[name] = Summary(kind, size, preview)
+
+    def __getitem__(self, name):
+        with self.lock:
+            if self.db is None:
+                return self.values[name]
+            if name in self.cache:
+                self.cache[name] = self.cache.pop(name)
+                return self.cache[name]
+            if name not in self.summaries:
+                raise KeyError(name)
+            (encoded,) = self.db.execute(
+                'SELECT value FROM data WHERE name = ?', (_key(name),)
+            ).fetchone()
+            value = json.loads(encoded)
+            self._cache(name, value)
+            return value
+
+    def __setitem__(self, name, value):
+        encoded = json.dumps(value)
+        summary = summarize(value, encoded)
+        with self.lock:
+            self.summaries[name] = summary
+            if self.db is None:
+                self.values[name] = value
+                return
+            self.db.execute(
+                'INSERT OR REPLACE INTO data (name, value, kind, size, preview) VALUES (?, ?, ?, ?, ?)',
+                (_key(name), encoded, summary.kind, summary.size, summary.preview)
+            )
+            self.db.commit()
+            self._cache(name, value)
+
+    def __delitem__(self, name):
+        with self.lock:
+            del self.summaries[name]
+            self.values.pop(name, None)
+            self.cache.pop(name, None)
+            if self.db is not None:
+                self.db.execute('DELETE FROM data WHERE name = ?', (_key(name),))
+                self.db.commit()
+
+    def __contains__(self, name):
+        return name in self.summaries
+
+    def __iter__(self):
+        return iter(list(self.summaries))
+
+    def __len__(self):
+        return len(self.summaries)
+
+    def _cache(self, name, value):
+        self.cache.pop(name, None)
+        self.cache[name] = value
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def summary(self, name):
+        return self.summaries[name]
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
@@ -43,3 +43,32 @@ def is_number(s):
         return True
     except ValueError:
         return False
+
+
+def parse_duration(duration):
+    '''Returns the number of seconds in a duration such as "2s", "500ms", "1.5m" or "3" (seconds).'''
+    match = re.match(r'^\s*(\d+(?:\.\d*)?|\.\d+)\s*(ms|s|m|h)?\s*$', str(duration))
+    if not match:
+        raise Exception('Invalid duration "%s"; expected e.g. 2s, 500ms or 1m.' % duration)
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+    return float(match.group(1)) * units[match.group(2) or 's']
+
+
+def format_size(size):
+    '''Returns a byte count in human-readable form (e.g. "512B", "1.5KB", "12.0MB").'''
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            break
+        size /= 1024.0
+    if unit == 'B':
+        return '%dB' % size
+    return '%.1f%s' % (size, unit)
+
+
+def parse_size(size):
+    '''Returns the number of bytes in a size such as "512", "64KB", "1.5MB" or "2G".'''
+    match = re.match(r'^\s*(\d+(?:\.\d*)?|\.\d+)\s*(b|k|kb|m|mb|g|gb)?\s*$', str(size), re.I)
+    if not match:
+        raise Exception('Invalid size "%s"; expected e.g. 512, 64KB or 10MB.' % size)
+    units = {'b': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+    return int(float(match.group(1)) * units[(match.group(2) or 'b')[0].lower()])
@@ -8,7 +8,7 @@ setup(
     description='RESTFul HTTP command-line script and modules',
     long_description="""Command-line script and modules for HTTP requests and HTML/JSON document parsing.""",
     namespace_packages=['rest_cli'],
-    packages=find_packages(exclude=['tests', '*.tests']),
+    packages=find_packages(exclude=['tests', '*.tests', 'benchmarks']),
     include_package_data=True,
     zip_safe=False,
     install_requires=[